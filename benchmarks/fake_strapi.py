@@ -0,0 +1,291 @@
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+CART_PATH = re.compile(r'^/api/carts/(?P<document_id>[^/]+)$')
+CART_PRODUCT_PATH = re.compile(r'^/api/cart-products/(?P<document_id>[^/]+)$')
+PRODUCT_PATH = re.compile(r'^/api/products/(?P<document_id>[^/]+)$')
+UPLOAD_PATH = re.compile(r'^/uploads/(?P<name>[^/]+)$')
+FIELD_KEY = re.compile(r'^\[fields\]\[\d+\]$')
+POPULATE_KEY = re.compile(r'^\[populate\]\[(?P<relation>[^\]]+)\]')
+RELATIONS = frozenset({'picture', 'cart_products', 'product'})
+
+
+def make_document_id():
+    return uuid.uuid4().hex[:24]
+
+
+def normalize_query(params):
+    """Приводит параметры запроса к виду [fields][0], [populate][связь][fields][0]"""
+    return {f"[{key.replace('[', '][', 1)}" if '[' in key else f"[{key}]": value for key, value in params.items()}
+
+
+def select_fields(entity, query, prefix=''):
+    """Оставляет в сущности поля и связи, запрошенные через fields и populate.
+
+    Как в Strapi 5: без fields возвращаются все простые поля, связи -
+    только указанные в populate, documentId - всегда. query - результат
+    normalize_query, параметры вложенной связи ищутся с префиксом
+    [populate][связь].
+    """
+    if entity is None:
+        return None
+    if isinstance(entity, list):
+        return [select_fields(item, query, prefix) for item in entity]
+
+    nested_query = {key[len(prefix):]: value for key, value in query.items() if key.startswith(prefix)}
+    fields = {value for key, value in nested_query.items() if FIELD_KEY.match(key)}
+    populate_all = nested_query.get('[populate]') == '*'
+    populated = {match['relation'] for match in map(POPULATE_KEY.match, nested_query) if match}
+
+    view = {}
+    for name, value in entity.items():
+        if name in RELATIONS:
+            if populate_all or name in populated:
+                view[name] = select_fields(value, query, f"{prefix}[populate][{name}]")
+        elif name == 'documentId' or not fields or name in fields:
+            view[name] = value
+    return view
+
+
+class FakeStrapiStore:
+    """Данные поддельного Strapi: продукты, корзины, позиции корзин и заказы в памяти"""
+
+    def __init__(self, catalog_size=50, picture_size=0):
+        self.lock = threading.Lock()
+        self.picture = b'\xff\xd8' + b'\0' * max(picture_size - 2, 0) if picture_size else None
+        self.products = {}
+        for number in range(1, catalog_size + 1):
+            document_id = f"product{number:05d}"
+            self.products[document_id] = {
+                'documentId': document_id,
+                'title': f"Рыба {number:05d}",
+                'price': 100 + number,
+                'description': f"Описание рыбы номер {number}",
+                'updatedAt': '2025-01-01T00:00:00.000Z',
+                'picture': [{
+                    'url': f"/uploads/{document_id}.jpg",
+                    'hash': document_id,
+                    'updatedAt': '2025-01-01T00:00:00.000Z',
+                }] if self.picture else [],
+            }
+        self.carts = {}
+        self.cart_products = {}
+        self.orders = {}
+
+
+class FakeStrapiServer:
+    """Локальная замена Strapi для бенчмарка.
+
+    Понимает запросы, которые делает product_service, с искусственной
+    задержкой latency секунд на каждый запрос, отдает только поля и
+    связи из fields и populate и считает обращения и байты JSON-ответов.
+    """
+
+    def __init__(self, catalog_size=50, latency=0.0, picture_size=0, listen='127.0.0.1', port=0):
+        self.store = FakeStrapiStore(catalog_size, picture_size)
+        self.latency = latency
+        self.calls = 0
+        self.json_responses = 0
+        self.json_bytes = 0
+        self._calls_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((listen, port), self._create_request_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='fake-strapi', daemon=True).start()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count_call(self):
+        with self._calls_lock:
+            self.calls += 1
+
+    def count_json_response(self, size):
+        with self._calls_lock:
+            self.json_responses += 1
+            self.json_bytes += size
+
+    def handle(self, method, path, params, payload):
+        store = self.store
+        with store.lock:
+            if method == 'GET' and path == '/api/products':
+                return 200, self._list(list(store.products.values()), params)
+
+            match = PRODUCT_PATH.match(path)
+            if method == 'GET' and match:
+                product = store.products.get(match['document_id'])
+                return (200, {'data': product}) if product else (404, {'error': 'not found'})
+
+            if path == '/api/carts':
+                if method == 'GET':
+                    tg_id = params.get('filters[tg_id][$eq]')
+                    carts = [
+                        self._cart_view(cart) for cart in store.carts.values()
+                        if tg_id is None or cart['tg_id'] == tg_id
+                    ]
+                    return 200, {'data': carts}
+                if method == 'POST':
+                    document_id = make_document_id()
+                    store.carts[document_id] = {'documentId': document_id, 'tg_id': payload['data']['tg_id']}
+                    return 200, {'data': store.carts[document_id]}
+
+            match = CART_PATH.match(path)
+            if method == 'GET' and match:
+                cart = store.carts.get(match['document_id'])
+                return (200, {'data': self._cart_view(cart)}) if cart else (404, {'error': 'not found'})
+
+            if path == '/api/cart-products':
+                if method == 'GET':
+                    cart_id = params.get('filters[cart][documentId][$eq]')
+                    product_id = params.get('filters[product][documentId][$eq]')
+                    cart_products = [
+                        self._cart_product_view(cart_product)
+                        for cart_product in store.cart_products.values()
+                        if cart_product['cart'] == cart_id and cart_product['product'] == product_id
+                    ]
+                    return 200, {'data': cart_products}
+                if method == 'POST':
+                    document_id = make_document_id()
+                    data = payload['data']
+                    store.cart_products[document_id] = {
+                        'documentId': document_id,
+                        'quantity': data['quantity'],
+                        'cart': data['cart']['connect'][0],
+                        'product': data['product']['connect'][0],
+                    }
+                    return 200, {'data': self._cart_product_view(store.cart_products[document_id])}
+
+            match = CART_PRODUCT_PATH.match(path)
+            if match:
+                cart_product = store.cart_products.get(match['document_id'])
+                if cart_product is None:
+                    return 404, {'error': 'not found'}
+                if method == 'GET':
+                    return 200, {'data': self._cart_product_view(cart_product)}
+                if method == 'PUT':
+                    cart_product['quantity'] = payload['data']['quantity']
+                    return 200, {'data': self._cart_product_view(cart_product)}
+                if method == 'DELETE':
+                    del store.cart_products[match['document_id']]
+                    return 200, {'data': None}
+
+            if path == '/api/orders':
+                if method == 'GET':
+                    cart_id = params.get('filters[cart][documentId][$eq]')
+                    created_after = params.get('filters[createdAt][$gt]', '')
+                    orders = sorted(
+                        (
+                            self._order_view(order) for order in store.orders.values()
+                            if order['cart'] == cart_id and order['createdAt'] > created_after
+                        ),
+                        key=lambda order: order['createdAt'],
+                        reverse=params.get('sort[0]') == 'createdAt:desc'
+                    )
+                    page_size = int(params.get('pagination[pageSize]', 25))
+                    return 200, {'data': orders[:page_size]}
+                if method == 'POST':
+                    document_id = make_document_id()
+                    store.orders[document_id] = {
+                        'documentId': document_id,
+                        'email': payload['data']['email'],
+                        'cart': payload['data']['cart']['connect'][0],
+                        'createdAt': datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+                    }
+                    return 200, {'data': self._order_view(store.orders[document_id])}
+
+        return 404, {'error': 'not found'}
+
+    def _list(self, entities, params):
+        page = int(params.get('pagination[page]', 1))
+        page_size = int(params.get('pagination[pageSize]', 25))
+        entities = sorted(entities, key=lambda entity: entity['title'])
+        page_count = max((len(entities) + page_size - 1) // page_size, 1)
+        return {
+            'data': entities[(page - 1) * page_size:page * page_size],
+            'meta': {'pagination': {
+                'page': page, 'pageSize': page_size, 'pageCount': page_count, 'total': len(entities),
+            }},
+        }
+
+    def _cart_view(self, cart):
+        cart_products = [
+            self._cart_product_view(cart_product)
+            for cart_product in self.store.cart_products.values()
+            if cart_product['cart'] == cart['documentId']
+        ]
+        return {**cart, 'cart_products': cart_products}
+
+    def _cart_product_view(self, cart_product):
+        return {
+            'documentId': cart_product['documentId'],
+            'quantity': cart_product['quantity'],
+            'product': self.store.products.get(cart_product['product']),
+        }
+
+    def _order_view(self, order):
+        return {'documentId': order['documentId'], 'email': order['email'], 'createdAt': order['createdAt']}
+
+    def _create_request_handler(self):
+        server = self
+
+        class FakeStrapiRequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def _handle(self, method):
+                server.count_call()
+                if server.latency:
+                    time.sleep(server.latency)
+
+                url = urlparse(self.path)
+                content_length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(content_length)) if content_length else None
+
+                if method == 'GET' and UPLOAD_PATH.match(url.path) and server.store.picture:
+                    self._send(200, server.store.picture, 'image/jpeg')
+                    return
+
+                params = dict(parse_qsl(url.query))
+                status, body = server.handle(method, url.path, params, payload)
+                if body.get('data') is not None:
+                    body['data'] = select_fields(body['data'], normalize_query(params))
+                body = json.dumps(body).encode('utf-8')
+                server.count_json_response(len(body))
+                self._send(status, body, 'application/json')
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def do_PUT(self):
+                self._handle('PUT')
+
+            def do_DELETE(self):
+                self._handle('DELETE')
+
+            def log_message(self, format, *args):
+                pass
+
+        return FakeStrapiRequestHandler
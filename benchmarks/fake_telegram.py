@@ -0,0 +1,130 @@
+import itertools
+import threading
+from types import SimpleNamespace
+
+
+class FakeBot:
+    """Заглушка Bot API: отвечает мгновенно и запоминает последнюю клавиатуру каждого чата.
+
+    Вместе с клавиатурой запоминается сообщение, в котором она пришла:
+    нажатия кнопок приходят из этого сообщения, как в Telegram, поэтому
+    правки сообщения на месте сохраняют его message_id.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self.keyboards = {}
+        self.keyboard_messages = {}
+        self.calls = 0
+
+    def remember(self, chat_id, reply_markup=None, message_id=None, **kwargs):
+        message = self.make_message(chat_id, message_id=message_id)
+        with self._lock:
+            self.calls += 1
+            if reply_markup is not None:
+                self.keyboards[chat_id] = reply_markup
+                self.keyboard_messages[chat_id] = message
+        return message
+
+    def make_message(self, chat_id, text=None, message_id=None):
+        bot = self
+        message = SimpleNamespace(
+            chat_id=chat_id,
+            message_id=message_id or next(self._message_ids),
+            text=text,
+            photo=[],
+        )
+        message.reply_text = lambda text, reply_markup=None, **kwargs: bot.remember(chat_id, reply_markup)
+        message.edit_reply_markup = lambda reply_markup=None, **kwargs: bot.remember(
+            chat_id, reply_markup, message_id=message.message_id
+        )
+        return message
+
+    def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        return self.remember(chat_id, reply_markup)
+
+    def send_photo(self, chat_id, photo, reply_markup=None, **kwargs):
+        message = self.remember(chat_id, reply_markup)
+        message.photo = [SimpleNamespace(file_id=f"file{next(self._file_ids)}")]
+        return message
+
+    def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        return self.remember(chat_id, reply_markup, message_id=message_id)
+
+    def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None, **kwargs):
+        return self.remember(chat_id, reply_markup, message_id=message_id)
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        with self._lock:
+            self.calls += 1
+            keyboard_message = self.keyboard_messages.get(chat_id)
+            if keyboard_message is not None and keyboard_message.message_id == message_id:
+                del self.keyboard_messages[chat_id]
+        return True
+
+    def find_callback_data(self, chat_id, prefix):
+        """Возвращает callback_data первой кнопки последней клавиатуры чата, начинающейся с prefix"""
+        reply_markup = self.keyboards.get(chat_id)
+        if reply_markup is None:
+            return None
+        for row in reply_markup.inline_keyboard:
+            for button in row:
+                if button.callback_data and button.callback_data.startswith(prefix):
+                    return button.callback_data
+        return None
+
+
+def make_context(bot):
+    """Создает контекст обработчика с пустыми user_data"""
+    return SimpleNamespace(bot=bot, user_data={})
+
+
+def make_text_update(bot, chat_id, text):
+    """Создает обновление с текстовым сообщением пользователя"""
+    message = bot.make_message(chat_id, text)
+    return SimpleNamespace(
+        message=message,
+        callback_query=None,
+        inline_query=None,
+        effective_chat=SimpleNamespace(id=chat_id),
+        effective_user=SimpleNamespace(id=chat_id),
+    )
+
+
+def make_callback_update(bot, chat_id, data):
+    """Создает обновление с нажатием inline-кнопки в последнем сообщении бота с клавиатурой"""
+    message = bot.keyboard_messages.get(chat_id) or bot.make_message(chat_id)
+    callback_query = SimpleNamespace(
+        data=data,
+        message=message,
+        answer=lambda *args, **kwargs: True,
+        edit_message_text=lambda text=None, reply_markup=None, **kwargs: bot.remember(
+            chat_id, reply_markup, message_id=message.message_id
+        ),
+    )
+    return SimpleNamespace(
+        message=None,
+        callback_query=callback_query,
+        inline_query=None,
+        effective_chat=SimpleNamespace(id=chat_id),
+        effective_user=SimpleNamespace(id=chat_id),
+    )
+
+
+def make_inline_update(bot, chat_id, query):
+    """Создает inline-запрос пользователя"""
+    user = SimpleNamespace(id=chat_id)
+    inline_query = SimpleNamespace(
+        query=query,
+        from_user=user,
+        answer=lambda results, **kwargs: bot.remember(chat_id),
+    )
+    return SimpleNamespace(
+        message=None,
+        callback_query=None,
+        inline_query=inline_query,
+        effective_chat=None,
+        effective_user=user,
+    )
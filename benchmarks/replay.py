@@ -0,0 +1,186 @@
+import argparse
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+import metrics
+from benchmarks.fake_strapi import FakeStrapiServer
+from benchmarks.fake_telegram import (
+    FakeBot,
+    make_callback_update,
+    make_context,
+    make_inline_update,
+    make_text_update,
+)
+from benchmarks.run_benchmark import format_report, get_bytes_per_response, get_redis_calls, percentile
+from dispatching import ChatOrderedExecutor
+from python_bot import MENU_PAGE_PREFIX, create_handlers, is_valid_email
+from strapi_client import StrapiClient
+from update_recorder import read_recorded_updates
+
+FIXED_CALLBACKS = {
+    'view_cart': 'cart',
+    'back_to_menu': 'menu',
+    'clear_cart': 'clear',
+    'pay': 'checkout',
+}
+
+
+def map_product_id(document_id, product_ids):
+    """Сопоставляет продукту из лога продукт локальной замены Strapi"""
+    digest = hashlib.sha1(document_id.encode('utf-8')).hexdigest()
+    return product_ids[int(digest, 16) % len(product_ids)]
+
+
+def map_update(entry, product_ids, bot, chat_id):
+    """Превращает запись лога в (шаг, обновление) для локального окружения или None"""
+    kind, data = entry['kind'], entry['data']
+
+    if kind == 'inline':
+        return 'inline', make_inline_update(bot, chat_id, data)
+
+    if kind == 'text':
+        if data == '/start':
+            step = 'start'
+        elif is_valid_email(data):
+            step = 'email'
+        else:
+            step = 'text'
+        return step, make_text_update(bot, chat_id, data)
+
+    if data in FIXED_CALLBACKS:
+        step = FIXED_CALLBACKS[data]
+    elif data.startswith(MENU_PAGE_PREFIX):
+        step = 'page'
+    elif data.startswith('buy_'):
+        step, data = 'add', f"buy_{map_product_id(data[len('buy_'):], product_ids)}"
+    elif data.startswith('remove_'):
+        step, data = 'remove', bot.find_callback_data(chat_id, 'remove_')
+        if data is None:
+            return None
+    else:
+        step, data = 'product', map_product_id(data, product_ids)
+    return step, make_callback_update(bot, chat_id, data)
+
+
+def replay(log_path, redis_url, speed=1.0, concurrency=16, catalog_size=50, strapi_latency=0.0,
+           picture_size=0):
+    """Воспроизводит лог обновлений с сохранением порядка внутри каждого чата"""
+    entries = read_recorded_updates(log_path)
+    strapi = FakeStrapiServer(catalog_size=catalog_size, latency=strapi_latency, picture_size=picture_size)
+    strapi.start()
+    try:
+        strapi_client = StrapiClient(strapi.url, 'replay-token', pool_size=concurrency * 2)
+        redis_client = metrics.InstrumentedRedis.from_url(redis_url, decode_responses=True)
+        handler = create_handlers(strapi_client, redis_client)
+        bot = FakeBot()
+        product_ids = sorted(strapi.store.products)
+
+        chat_id_base = random.randint(10 ** 9, 2 * 10 ** 9)
+        chat_ids = {}
+        contexts = {}
+        service_times = defaultdict(list)
+        response_times = []
+        lock = threading.Lock()
+
+        def process(chat_id, entry, scheduled_at):
+            mapped = map_update(entry, product_ids, bot, chat_id)
+            if mapped is None:
+                return
+            step, update = mapped
+
+            started_at = time.perf_counter()
+            handler(update, contexts[chat_id])
+            finished_at = time.perf_counter()
+            with lock:
+                service_times[step].append(finished_at - started_at)
+                response_times.append(finished_at - scheduled_at)
+
+        executor = ChatOrderedExecutor(max_workers=concurrency)
+        strapi_calls_before = strapi.calls
+        strapi_json_before = (strapi.json_responses, strapi.json_bytes)
+        redis_calls_before = get_redis_calls()
+        first_ts = entries[0]['ts'] if entries else 0
+        started_at = time.perf_counter()
+
+        for entry in entries:
+            chat_id = chat_ids.setdefault(entry['chat'], chat_id_base + len(chat_ids))
+            contexts.setdefault(chat_id, make_context(bot))
+
+            scheduled_at = started_at
+            if speed > 0:
+                scheduled_at += (entry['ts'] - first_ts) / speed
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(chat_id, process, chat_id, entry, max(scheduled_at, started_at))
+
+        executor.shutdown(wait=True)
+        elapsed = time.perf_counter() - started_at
+        strapi_client.close()
+    finally:
+        strapi.shutdown()
+
+    all_service_times = [value for values in service_times.values() for value in values]
+    updates = len(all_service_times)
+    return {
+        'users': len(chat_ids),
+        'concurrency': concurrency,
+        'updates': updates,
+        'elapsed_seconds': round(elapsed, 3),
+        'updates_per_second': round(updates / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(percentile(all_service_times, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(all_service_times, 0.99) * 1000, 2),
+        'response_p50_ms': round(percentile(response_times, 0.5) * 1000, 2),
+        'response_p99_ms': round(percentile(response_times, 0.99) * 1000, 2),
+        'strapi_calls_per_update': round((strapi.calls - strapi_calls_before) / updates, 2) if updates else 0,
+        'strapi_bytes_per_response': get_bytes_per_response(strapi, strapi_json_before),
+        'redis_calls_per_update': round((get_redis_calls() - redis_calls_before) / updates, 2) if updates else 0,
+        'steps': {
+            step: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 0.5) * 1000, 2),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            }
+            for step, values in service_times.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанных обновлений на локальной замене Strapi')
+    parser.add_argument('log_path', help='JSONL-лог, записанный с RECORD_UPDATES_PATH')
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0')
+    parser.add_argument('--speed', type=float, default=1.0, help='ускорение, 0 - без пауз')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--catalog-size', type=int, default=50)
+    parser.add_argument('--strapi-latency', type=float, default=0.0, help='задержка ответа Strapi, с')
+    parser.add_argument('--picture-kb', type=int, default=0, help='размер изображения продукта, КБ')
+    parser.add_argument('--json', action='store_true', help='вывести результат в JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    result = replay(
+        args.log_path,
+        args.redis_url,
+        speed=args.speed,
+        concurrency=args.concurrency,
+        catalog_size=args.catalog_size,
+        strapi_latency=args.strapi_latency,
+        picture_size=args.picture_kb * 1024
+    )
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(result))
+        print(f"\nОтвет пользователю с учетом очереди чата: "
+              f"p50 {result['response_p50_ms']} мс, p99 {result['response_p99_ms']} мс")
+
+
+if __name__ == '__main__':
+    main()
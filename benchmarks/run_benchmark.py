@@ -0,0 +1,188 @@
+import argparse
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from benchmarks.fake_strapi import FakeStrapiServer
+from benchmarks.fake_telegram import FakeBot, make_callback_update, make_context, make_text_update
+from python_bot import create_handlers
+from strapi_client import StrapiClient
+
+
+def percentile(values, fraction):
+    """Возвращает перцентиль по методу ближайшего ранга"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def build_script(chat_id, product_ids):
+    """Возвращает сценарий пользователя: список (шаг, тип обновления, данные).
+
+    Пользователь добавляет в корзину по одному разу каждый продукт из
+    product_ids, поэтому в корзине столько же разных позиций.
+    """
+    script = [('start', 'text', '/start')]
+    for position, product_id in enumerate(product_ids):
+        if position:
+            script.append(('menu', 'callback', 'back_to_menu'))
+        script += [
+            ('product', 'callback', product_id),
+            ('add', 'callback', f'buy_{product_id}'),
+        ]
+    script += [
+        ('cart', 'callback', 'view_cart'),
+        ('remove', 'callback', 'remove_'),
+        ('checkout', 'callback', 'pay'),
+        ('email', 'text', f'user{chat_id}@example.com'),
+    ]
+    return script
+
+
+def run_user(handler, bot, chat_id, script, latencies):
+    """Проигрывает сценарий одного пользователя и записывает задержку каждого обновления"""
+    context = make_context(bot)
+    for step, update_type, data in script:
+        if update_type == 'text':
+            update = make_text_update(bot, chat_id, data)
+        else:
+            if data == 'remove_':
+                data = bot.find_callback_data(chat_id, 'remove_')
+                if data is None:
+                    continue
+            update = make_callback_update(bot, chat_id, data)
+
+        started_at = time.perf_counter()
+        handler(update, context)
+        latencies[step].append(time.perf_counter() - started_at)
+
+
+def get_redis_calls():
+    return sum(value['value'] for value in metrics.REGISTRY.snapshot()['redis_calls_total'])
+
+
+def get_bytes_per_response(strapi, before):
+    """Средний размер JSON-ответа Strapi в байтах после снимка счетчиков before"""
+    responses = strapi.json_responses - before[0]
+    return round((strapi.json_bytes - before[1]) / responses) if responses else 0
+
+
+def run_benchmark(redis_url, users=20, concurrency=8, catalog_size=50, cart_adds=3,
+                  strapi_latency=0.0, picture_size=0):
+    """Запускает бенчмарк и возвращает словарь с результатами"""
+    strapi = FakeStrapiServer(
+        catalog_size=max(catalog_size, cart_adds), latency=strapi_latency, picture_size=picture_size
+    )
+    strapi.start()
+    try:
+        strapi_client = StrapiClient(strapi.url, 'benchmark-token', pool_size=concurrency * 2)
+        redis_client = metrics.InstrumentedRedis.from_url(redis_url, decode_responses=True)
+        handler = create_handlers(strapi_client, redis_client)
+        bot = FakeBot()
+
+        product_ids = sorted(strapi.store.products)
+        chat_id_base = random.randint(10 ** 9, 2 * 10 ** 9)
+        scripts = []
+        for user in range(users):
+            user_product_ids = [
+                product_ids[(user + position) % len(product_ids)] for position in range(cart_adds)
+            ]
+            scripts.append((chat_id_base + user, build_script(chat_id_base + user, user_product_ids)))
+
+        latencies = defaultdict(list)
+        strapi_calls_before = strapi.calls
+        strapi_json_before = (strapi.json_responses, strapi.json_bytes)
+        redis_calls_before = get_redis_calls()
+        started_at = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(run_user, handler, bot, chat_id, script, latencies)
+                for chat_id, script in scripts
+            ]
+            for future in futures:
+                future.result()
+
+        elapsed = time.perf_counter() - started_at
+        strapi_client.close()
+    finally:
+        strapi.shutdown()
+
+    all_latencies = [latency for step_latencies in latencies.values() for latency in step_latencies]
+    updates = len(all_latencies)
+    return {
+        'users': users,
+        'concurrency': concurrency,
+        'updates': updates,
+        'elapsed_seconds': round(elapsed, 3),
+        'updates_per_second': round(updates / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(percentile(all_latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(all_latencies, 0.99) * 1000, 2),
+        'strapi_calls_per_update': round((strapi.calls - strapi_calls_before) / updates, 2) if updates else 0,
+        'strapi_bytes_per_response': get_bytes_per_response(strapi, strapi_json_before),
+        'redis_calls_per_update': round((get_redis_calls() - redis_calls_before) / updates, 2) if updates else 0,
+        'steps': {
+            step: {
+                'count': len(step_latencies),
+                'p50_ms': round(percentile(step_latencies, 0.5) * 1000, 2),
+                'p99_ms': round(percentile(step_latencies, 0.99) * 1000, 2),
+            }
+            for step, step_latencies in latencies.items()
+        },
+    }
+
+
+def format_report(result):
+    """Форматирует результаты бенчмарка в читаемую таблицу"""
+    lines = [
+        f"Пользователей: {result['users']}, потоков: {result['concurrency']}, "
+        f"обновлений: {result['updates']} за {result['elapsed_seconds']} с",
+        f"Пропускная способность: {result['updates_per_second']} обновлений/с",
+        f"Задержка: p50 {result['p50_ms']} мс, p99 {result['p99_ms']} мс",
+        f"Запросов к Strapi на обновление: {result['strapi_calls_per_update']}",
+        f"Байт в JSON-ответе Strapi: {result['strapi_bytes_per_response']}",
+        f"Обращений к Redis на обновление: {result['redis_calls_per_update']}",
+        '',
+        f"{'шаг':<10}{'кол-во':>8}{'p50, мс':>10}{'p99, мс':>10}",
+    ]
+    for step, step_result in result['steps'].items():
+        lines.append(
+            f"{step:<10}{step_result['count']:>8}{step_result['p50_ms']:>10}{step_result['p99_ms']:>10}"
+        )
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сквозной бенчмарк бота на поддельных Strapi и Telegram')
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--catalog-size', type=int, default=50)
+    parser.add_argument('--cart-adds', type=int, default=3, help='число разных продуктов в корзине')
+    parser.add_argument('--strapi-latency', type=float, default=0.0, help='задержка ответа Strapi, с')
+    parser.add_argument('--picture-kb', type=int, default=0, help='размер изображения продукта, КБ')
+    parser.add_argument('--json', action='store_true', help='вывести результат в JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    result = run_benchmark(
+        args.redis_url,
+        users=args.users,
+        concurrency=args.concurrency,
+        catalog_size=args.catalog_size,
+        cart_adds=args.cart_adds,
+        strapi_latency=args.strapi_latency,
+        picture_size=args.picture_kb * 1024
+    )
+    print(json.dumps(result, ensure_ascii=False, indent=2) if args.json else format_report(result))
+
+
+if __name__ == '__main__':
+    main()
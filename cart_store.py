@@ -0,0 +1,228 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class CartIdCache:
+    """Соответствие tg_id -> documentId корзины.
+
+    documentId хранится в поле cart_id сессии чата и живет столько же,
+    сколько сессия. Перед Redis стоит LRU-кеш в памяти процесса, поэтому в
+    установившемся режиме корзина пользователя находится без обращений к
+    Strapi и Redis. Создание корзины выполняется под блокировкой Redis,
+    чтобы одновременные первые нажатия не создали в Strapi две корзины.
+    """
+
+    def __init__(self, sessions, creator, max_size=10000, lock_timeout=10,
+                 key_prefix='cart_id'):
+        self.sessions = sessions
+        self.creator = creator
+        self.max_size = max_size
+        self.lock_timeout = lock_timeout
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_or_create(self, tg_id):
+        """Возвращает documentId корзины пользователя, создавая ее при необходимости"""
+        tg_id = str(tg_id)
+
+        cart_document_id = self._get_local(tg_id)
+        if cart_document_id:
+            CACHE_REQUESTS.inc(cache='cart_id', result='hit')
+            return cart_document_id
+
+        cart_document_id = self.sessions.get_cart_id(tg_id)
+        if cart_document_id:
+            CACHE_REQUESTS.inc(cache='cart_id', result='redis')
+            self._set_local(tg_id, cart_document_id)
+            return cart_document_id
+
+        CACHE_REQUESTS.inc(cache='cart_id', result='miss')
+
+        with self.sessions.redis_client.lock(
+            f"{self.key_prefix}:{tg_id}:lock",
+            timeout=self.lock_timeout,
+            blocking_timeout=self.lock_timeout
+        ):
+            cart_document_id = self.sessions.get_cart_id(tg_id)
+            if not cart_document_id:
+                cart_document_id = self.creator(tg_id)
+                self.sessions.save_cart_id(tg_id, cart_document_id)
+
+        self._set_local(tg_id, cart_document_id)
+        return cart_document_id
+
+    def remember(self, tg_id, cart_document_id):
+        """Запоминает уже известную корзину (например, из сессии) без обращения к Redis"""
+        self._set_local(str(tg_id), cart_document_id)
+
+    def peek(self, tg_id):
+        """Возвращает корзину из памяти процесса, если она там есть"""
+        return self._get_local(str(tg_id))
+
+    def invalidate(self, tg_id):
+        """Забывает корзину пользователя в памяти и в сессии"""
+        tg_id = str(tg_id)
+        with self._lock:
+            self._entries.pop(tg_id, None)
+        self.sessions.save_cart_id(tg_id, None)
+
+    def _get_local(self, tg_id):
+        with self._lock:
+            cart_document_id = self._entries.get(tg_id)
+            if cart_document_id is not None:
+                self._entries.move_to_end(tg_id)
+            return cart_document_id
+
+    def _set_local(self, tg_id, cart_document_id):
+        with self._lock:
+            self._entries[tg_id] = cart_document_id
+            self._entries.move_to_end(tg_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class CartProjection:
+    """Проекция корзины пользователя в Redis для мгновенной отрисовки.
+
+    Позиции корзины хранятся в хеше Redis (cart_product_id -> JSON с
+    названием, ценой и количеством) и обновляются сквозной записью после
+    каждого изменения корзины в Strapi. Strapi остается источником истины:
+    проекция перечитывается, если она отсутствует, устарела или была
+    помечена как несогласованная после неудачной записи. Ключи проекции
+    живут ttl секунд после последней записи, как и сессия.
+    """
+
+    def __init__(self, redis_client, loader, reconcile_interval=300, key_prefix='cart',
+                 ttl=7 * 24 * 3600):
+        self.redis_client = redis_client
+        self.loader = loader
+        self.reconcile_interval = reconcile_interval
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+
+    def _items_key(self, tg_id):
+        return f"{self.key_prefix}:{tg_id}:items"
+
+    def _synced_key(self, tg_id):
+        return f"{self.key_prefix}:{tg_id}:synced_at"
+
+    def get(self, tg_id, cart_document_id):
+        """Возвращает содержимое корзины в формате get_cart_content_with_details"""
+        pipeline = self.redis_client.pipeline()
+        pipeline.get(self._synced_key(tg_id))
+        pipeline.hgetall(self._items_key(tg_id))
+        synced_at, raw_items = pipeline.execute()
+
+        if synced_at is None or time.time() - float(synced_at) > self.reconcile_interval:
+            CACHE_REQUESTS.inc(cache='cart_projection', result='miss')
+            cart_content = self.loader(cart_document_id)
+            self.replace(tg_id, cart_content)
+            return cart_content
+
+        CACHE_REQUESTS.inc(cache='cart_projection', result='hit')
+
+        lines = sorted(
+            (json.loads(raw_line) for raw_line in raw_items.values()),
+            key=lambda line: line['added_at']
+        )
+        items = []
+        total_sum = 0
+        for line in lines:
+            item_total = line['price'] * line['quantity']
+            items.append({
+                'title': line['title'],
+                'quantity': line['quantity'],
+                'price': line['price'],
+                'total': item_total,
+                'cart_product_id': line['cart_product_id']
+            })
+            total_sum += item_total
+
+        return {
+            'items': items,
+            'total_sum': total_sum
+        }
+
+    def replace(self, tg_id, cart_content):
+        """Полностью перезаписывает проекцию содержимым корзины из Strapi"""
+        now = time.time()
+        lines = {}
+        for position, item in enumerate(cart_content['items']):
+            lines[item['cart_product_id']] = self._dump_line(
+                item['cart_product_id'], item['title'], item['price'],
+                item['quantity'], now + position / 1000
+            )
+
+        pipeline = self.redis_client.pipeline()
+        pipeline.delete(self._items_key(tg_id))
+        if lines:
+            pipeline.hmset(self._items_key(tg_id), lines)
+        pipeline.set(self._synced_key(tg_id), now)
+        self._expire(pipeline, tg_id)
+        pipeline.execute()
+
+    def add_line(self, tg_id, cart_product_id, title, price, quantity):
+        """Записывает позицию корзины с ее итоговым количеством после записи в Strapi"""
+        def write(pipeline):
+            added_at = time.time()
+            raw_line = self.redis_client.hget(self._items_key(tg_id), cart_product_id)
+            if raw_line:
+                added_at = json.loads(raw_line)['added_at']
+            pipeline.hset(
+                self._items_key(tg_id), cart_product_id,
+                self._dump_line(cart_product_id, title, price, quantity, added_at)
+            )
+
+        self._write_through(tg_id, write)
+
+    def remove_line(self, tg_id, cart_product_id):
+        """Удаляет позицию корзины после ее удаления в Strapi"""
+        self._write_through(
+            tg_id,
+            lambda pipeline: pipeline.hdel(self._items_key(tg_id), cart_product_id)
+        )
+
+    def clear(self, tg_id):
+        """Делает проекцию пустой после очистки корзины или оформления заказа"""
+        self.replace(tg_id, {'items': [], 'total_sum': 0})
+
+    def invalidate(self, tg_id):
+        """Помечает проекцию несогласованной, следующее чтение возьмет корзину из Strapi"""
+        try:
+            self.redis_client.delete(self._synced_key(tg_id), self._items_key(tg_id))
+        except Exception as e:
+            logger.warning(f"Не удалось сбросить проекцию корзины: {e}")
+
+    def _write_through(self, tg_id, write):
+        try:
+            if not self.redis_client.exists(self._synced_key(tg_id)):
+                return
+            pipeline = self.redis_client.pipeline()
+            write(pipeline)
+            self._expire(pipeline, tg_id)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Не удалось обновить проекцию корзины: {e}")
+            self.invalidate(tg_id)
+
+    def _expire(self, pipeline, tg_id):
+        pipeline.expire(self._items_key(tg_id), self.ttl)
+        pipeline.expire(self._synced_key(tg_id), self.ttl)
+
+    @staticmethod
+    def _dump_line(cart_product_id, title, price, quantity, added_at):
+        return json.dumps({
+            'cart_product_id': cart_product_id,
+            'title': title,
+            'price': float(price),
+            'quantity': quantity,
+            'added_at': added_at
+        })
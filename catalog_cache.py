@@ -0,0 +1,204 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogCache:
+    """Постраничный кеш каталога продуктов с ограниченным временем жизни.
+
+    Каждая страница каталога загружается отдельно при первом обращении и
+    хранится в памяти процесса, а если передан redis_client, дополнительно
+    в Redis, чтобы несколько процессов бота использовали одни и те же
+    копии. В памяти держится не больше max_pages последних страниц, поэтому
+    расход памяти не зависит от размера каталога. Версия страницы
+    вычисляется по ее содержимому, поэтому у всех процессов она совпадает.
+
+    Устаревшая страница (не старше max_stale секунд) отдается сразу, а
+    обновление идет в фоне (stale-while-revalidate). Если Strapi недоступен,
+    бот продолжает показывать последнюю известную копию. Отсутствующую
+    страницу загружает один поток, одновременные запросы той же страницы
+    ждут его результат.
+    """
+
+    def __init__(self, loader, ttl=300, redis_client=None, redis_key='catalog:products',
+                 max_stale=24 * 3600, max_pages=50):
+        self.loader = loader
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self.redis_key = redis_key
+        self.max_stale = max_stale
+        self.max_pages = max_pages
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._loading = {}
+
+    def get(self, page=1):
+        """Возвращает пару (версия, страница каталога), загружая страницу при необходимости"""
+        with self._lock:
+            entry = self._entries.get(page)
+            if entry is not None:
+                expires_at, snapshot = entry
+                now = time.monotonic()
+                if now < expires_at + self.max_stale:
+                    self._entries.move_to_end(page)
+                    is_stale = now >= expires_at
+                    CACHE_REQUESTS.inc(cache='catalog', result='stale' if is_stale else 'hit')
+                    if is_stale and page not in self._refreshing:
+                        self._refreshing.add(page)
+                        threading.Thread(target=self._refresh, args=(page,), daemon=True).start()
+                    return snapshot['version'], snapshot['page']
+
+            CACHE_REQUESTS.inc(cache='catalog', result='miss')
+            future = self._loading.get(page)
+            is_loader = future is None
+            if is_loader:
+                future = self._loading[page] = Future()
+
+        if is_loader:
+            try:
+                snapshot = self._load_snapshot(page)
+                self._store(page, snapshot)
+                future.set_result(snapshot)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._loading.pop(page, None)
+
+        snapshot = future.result()
+        return snapshot['version'], snapshot['page']
+
+    def _refresh(self, page):
+        try:
+            self._store(page, self._load_snapshot(page))
+        except Exception as e:
+            logger.warning(f"Не удалось обновить страницу каталога {page}, отдаем устаревшую: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(page)
+
+    def _load_snapshot(self, page):
+        snapshot = self._read_shared(page)
+        if snapshot is None:
+            catalog_page = self.loader(page)
+            snapshot = {'version': self._make_version(catalog_page), 'page': catalog_page}
+            self._write_shared(page, snapshot)
+        return snapshot
+
+    def _store(self, page, snapshot):
+        with self._lock:
+            self._entries[page] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(page)
+            while len(self._entries) > self.max_pages:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Сбрасывает все страницы в памяти и в Redis, следующий запрос загрузит их заново"""
+        with self._lock:
+            self._entries.clear()
+            if self.redis_client is not None:
+                try:
+                    shared_keys = list(self.redis_client.scan_iter(match=f"{self.redis_key}:*"))
+                    if shared_keys:
+                        self.redis_client.delete(*shared_keys)
+                except Exception as e:
+                    logger.warning(f"Не удалось сбросить каталог в Redis: {e}")
+
+    def _read_shared(self, page):
+        if self.redis_client is None:
+            return None
+        try:
+            raw_snapshot = self.redis_client.get(f"{self.redis_key}:{page}")
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать каталог из Redis: {e}")
+            return None
+        if raw_snapshot is None:
+            return None
+        return json.loads(raw_snapshot)
+
+    def _write_shared(self, page, snapshot):
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.set(f"{self.redis_key}:{page}", json.dumps(snapshot), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить каталог в Redis: {e}")
+
+    @staticmethod
+    def _make_version(catalog_page):
+        serialized = json.dumps(catalog_page, sort_keys=True).encode('utf-8')
+        return hashlib.sha1(serialized).hexdigest()
+
+
+class ProductCache:
+    """LRU-кеш карточек продуктов с ограниченным временем жизни записей.
+
+    Как и CatalogCache, отдает устаревшую карточку сразу и обновляет ее
+    в фоне, поэтому во время сбоев Strapi открытые ранее карточки
+    продолжают работать.
+    """
+
+    def __init__(self, loader, max_size=256, ttl=300, max_stale=24 * 3600):
+        self.loader = loader
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._refreshing = set()
+
+    def get(self, document_id):
+        """Возвращает карточку продукта, загружая ее из Strapi только при промахе"""
+        with self._lock:
+            entry = self._entries.get(document_id)
+            if entry is not None:
+                expires_at, product = entry
+                now = time.monotonic()
+                if now < expires_at + self.max_stale:
+                    self._entries.move_to_end(document_id)
+                    is_stale = now >= expires_at
+                    CACHE_REQUESTS.inc(cache='product', result='stale' if is_stale else 'hit')
+                    if is_stale and document_id not in self._refreshing:
+                        self._refreshing.add(document_id)
+                        threading.Thread(
+                            target=self._refresh, args=(document_id,), daemon=True
+                        ).start()
+                    return product
+
+        CACHE_REQUESTS.inc(cache='product', result='miss')
+        product = self.loader(document_id)
+        self._store(document_id, product)
+        return product
+
+    def _refresh(self, document_id):
+        try:
+            self._store(document_id, self.loader(document_id))
+        except Exception as e:
+            logger.warning(f"Не удалось обновить карточку {document_id}, отдаем устаревшую: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(document_id)
+
+    def _store(self, document_id, product):
+        with self._lock:
+            self._entries[document_id] = (time.monotonic() + self.ttl, product)
+            self._entries.move_to_end(document_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, document_id=None):
+        """Сбрасывает одну карточку или весь кеш"""
+        with self._lock:
+            if document_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(document_id, None)
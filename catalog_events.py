@@ -0,0 +1,140 @@
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CATALOG_EVENTS_CHANNEL = 'catalog:events'
+CATALOG_MODELS = ('product',)
+
+
+def publish_catalog_event(redis_client, model, document_id=None, channel=CATALOG_EVENTS_CHANNEL):
+    """Сообщает всем процессам бота, что запись model в Strapi изменилась"""
+    redis_client.publish(channel, json.dumps({'model': model, 'document_id': document_id}))
+
+
+class CatalogInvalidator:
+    """Сбрасывает кеши каталога, карточек и поисковый индекс по событиям из Redis pub/sub.
+
+    События публикует StrapiWebhookServer, поэтому одно изменение продукта
+    в Strapi сбрасывает кеши во всех процессах бота. Событие, пришедшее,
+    пока подписка разорвана, теряется: такие изменения подхватываются по
+    истечении TTL кешей.
+    """
+
+    def __init__(self, redis_client, catalog_cache, product_cache, search_index,
+                 channel=CATALOG_EVENTS_CHANNEL, retry_delay=5):
+        self.redis_client = redis_client
+        self.catalog_cache = catalog_cache
+        self.product_cache = product_cache
+        self.search_index = search_index
+        self.channel = channel
+        self.retry_delay = retry_delay
+
+    def start(self):
+        """Подписывается на канал событий в фоновом потоке"""
+        threading.Thread(target=self._listen, name='catalog-events', daemon=True).start()
+
+    def handle_event(self, event):
+        """Сбрасывает кеши, которые затрагивает изменение записи"""
+        if event.get('model') not in CATALOG_MODELS:
+            return
+        self.product_cache.invalidate(event.get('document_id'))
+        self.catalog_cache.invalidate()
+        self.search_index.invalidate()
+        logger.info(f"Кеши каталога сброшены: {event}")
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    try:
+                        self.handle_event(json.loads(message['data']))
+                    except ValueError:
+                        logger.warning(f"Некорректное событие каталога: {message['data']}")
+            except Exception as e:
+                logger.warning(f"Подписка на события каталога прервана: {e}")
+                time.sleep(self.retry_delay)
+
+
+class StrapiWebhookServer:
+    """HTTP-эндпоинт для webhook Strapi: изменения записей публикуются в канал событий каталога.
+
+    Strapi присылает entry.* с полями model и entry.documentId, события
+    корзин и заказов пропускаются. У media.* нет model: изменение файла
+    может затронуть изображение любого продукта, поэтому оно публикуется
+    как изменение всех продуктов.
+    """
+
+    def __init__(self, redis_client, listen='127.0.0.1', port=8444, url_path='strapi', secret=None,
+                 channel=CATALOG_EVENTS_CHANNEL):
+        self.redis_client = redis_client
+        self.url_path = '/' + url_path.lstrip('/')
+        self.secret = secret
+        self.channel = channel
+        self.httpd = ThreadingHTTPServer((listen, port), self._create_request_handler())
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        """Запускает сервер в фоновом потоке"""
+        threading.Thread(target=self.httpd.serve_forever, name='strapi-webhook', daemon=True).start()
+
+    def shutdown(self):
+        """Останавливает сервер и освобождает сокет"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle_event(self, payload):
+        """Публикует событие webhook Strapi в канал событий каталога"""
+        event = payload.get('event', '')
+        if event.startswith('media.'):
+            for model in CATALOG_MODELS:
+                publish_catalog_event(self.redis_client, model, channel=self.channel)
+            return
+
+        if payload.get('model') not in CATALOG_MODELS:
+            return
+        entry = payload.get('entry') or {}
+        publish_catalog_event(
+            self.redis_client, payload.get('model'), entry.get('documentId'), channel=self.channel
+        )
+
+    def _create_request_handler(self):
+        server = self
+
+        class StrapiWebhookRequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.url_path:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                if server.secret and self.headers.get('Authorization') != server.secret:
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+
+                try:
+                    content_length = int(self.headers.get('Content-Length', 0))
+                    payload = json.loads(self.rfile.read(content_length))
+                    server.handle_event(payload)
+                except (ValueError, AttributeError) as e:
+                    logger.warning(f"Некорректный webhook Strapi: {e}")
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return StrapiWebhookRequestHandler
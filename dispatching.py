@@ -0,0 +1,138 @@
+import json
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def get_update_chat_id(update):
+    """Возвращает чат, к которому относится обновление"""
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedExecutor:
+    """Пул потоков, который обрабатывает разные чаты параллельно, а один чат строго по порядку.
+
+    Для каждого чата держится очередь задач. Пока очередь не пуста, ее
+    разбирает ровно один поток пула, поэтому медленный запрос одного
+    пользователя не задерживает остальных, а его собственные обновления
+    не обгоняют друг друга.
+    """
+
+    def __init__(self, max_workers=16):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat-worker')
+        self._lock = threading.Lock()
+        self._queues = {}
+
+    def submit(self, chat_id, func, *args):
+        """Ставит задачу в очередь чата"""
+        with self._lock:
+            queue = self._queues.get(chat_id)
+            if queue is not None:
+                queue.append((func, args))
+                return
+            self._queues[chat_id] = deque([(func, args)])
+        self._executor.submit(self._drain, chat_id)
+
+    def _drain(self, chat_id):
+        while True:
+            with self._lock:
+                queue = self._queues[chat_id]
+                if not queue:
+                    del self._queues[chat_id]
+                    return
+                func, args = queue.popleft()
+            try:
+                func(*args)
+            except Exception:
+                logger.exception(f"Ошибка обработки обновления чата {chat_id}")
+
+    def shutdown(self, wait=True):
+        """Дожидается завершения задач и останавливает пул"""
+        self._executor.shutdown(wait=wait)
+
+
+def create_ordered_handler(executor, handler):
+    """Оборачивает обработчик так, чтобы диспетчер только раскладывал обновления по очередям чатов"""
+    def dispatch_update(update, context):
+        executor.submit(get_update_chat_id(update), handler, update, context)
+
+    return dispatch_update
+
+
+class WebhookServer:
+    """Локальный HTTP-эндпоинт для приема обновлений Telegram через webhook.
+
+    Принимает POST с JSON обновления на url_path и кладет его в очередь
+    диспетчера python-telegram-bot. Для проверки достаточно отправить
+    на эндпоинт синтетическое обновление, например, через curl.
+    """
+
+    def __init__(self, bot, update_queue, listen='127.0.0.1', port=8443,
+                 url_path='telegram', secret_token=None):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.url_path = '/' + url_path.lstrip('/')
+        self.secret_token = secret_token
+        self.httpd = ThreadingHTTPServer((listen, port), self._create_request_handler())
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def serve_forever(self):
+        """Обрабатывает запросы, пока сервер не будет остановлен"""
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        """Останавливает serve_forever, запущенный в другом потоке"""
+        self.httpd.shutdown()
+
+    def close(self):
+        """Освобождает сокет сервера"""
+        self.httpd.server_close()
+
+    def _create_request_handler(self):
+        server = self
+
+        class WebhookRequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.url_path:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                if server.secret_token and self.headers.get(SECRET_TOKEN_HEADER) != server.secret_token:
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+
+                try:
+                    content_length = int(self.headers.get('Content-Length', 0))
+                    update_data = json.loads(self.rfile.read(content_length))
+                    update = Update.de_json(update_data, server.bot)
+                except (ValueError, TypeError, KeyError) as e:
+                    logger.warning(f"Некорректное обновление webhook: {e}")
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                server.update_queue.put(update)
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return WebhookRequestHandler
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from io import BytesIO
+
+import requests
+
+from metrics import CACHE_REQUESTS
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_image(image_bytes, max_side=1280, jpeg_quality=85):
+    """Уменьшает изображение до размеров Telegram и пережимает в JPEG.
+
+    Без Pillow, а также для уже подходящих JPEG и файлов, которые не
+    удалось разобрать, возвращает исходные байты.
+    """
+    if Image is None:
+        return image_bytes
+
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            if image.format == 'JPEG' and max(image.size) <= max_side:
+                return image_bytes
+
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, 'white')
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            output = BytesIO()
+            image.save(output, 'JPEG', quality=jpeg_quality, optimize=True, progressive=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Не удалось обработать изображение, отправляем оригинал: {e}")
+        return image_bytes
+
+    prepared_bytes = output.getvalue()
+    if len(prepared_bytes) >= len(image_bytes):
+        return image_bytes
+    return prepared_bytes
+
+
+class ImageCache:
+    """Дисковый LRU-кеш изображений продуктов, подготовленных для Telegram.
+
+    Изображение скачивается и уменьшается один раз, дальше отдается с
+    диска. Не чаще раза в revalidate_after секунд файл перепроверяется
+    условным запросом (If-None-Match / If-Modified-Since): при ответе 304
+    оригинал заново не скачивается. Если Strapi недоступен, отдается
+    сохраненная копия. Общий размер кеша ограничен max_bytes, первыми
+    удаляются файлы, к которым дольше всего не обращались. Каталог кеша
+    создается при сохранении первого изображения.
+    """
+
+    def __init__(self, strapi_client, cache_dir, max_bytes=200 * 1024 * 1024,
+                 revalidate_after=3600, max_side=1280, jpeg_quality=85):
+        self.strapi_client = strapi_client
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """Возвращает подготовленное изображение по URL, скачивая его только при необходимости"""
+        image_path, meta_path = self._paths(url)
+        meta = self._read_meta(meta_path)
+        cached_bytes = self._read_image(image_path) if meta is not None else None
+
+        if cached_bytes is not None and time.time() - meta['checked_at'] < self.revalidate_after:
+            CACHE_REQUESTS.inc(cache='image', result='hit')
+            self._touch(image_path)
+            return cached_bytes
+
+        headers = {}
+        if cached_bytes is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            response = self.strapi_client.request('GET', url, headers=headers)
+        except requests.RequestException as e:
+            if cached_bytes is None:
+                raise
+            logger.warning(f"Не удалось проверить изображение {url}, отдаем сохраненное: {e}")
+            return cached_bytes
+
+        if response.status_code == 304 and cached_bytes is not None:
+            CACHE_REQUESTS.inc(cache='image', result='revalidated')
+            meta['checked_at'] = time.time()
+            self._write_meta(meta_path, meta)
+            self._touch(image_path)
+            return cached_bytes
+
+        CACHE_REQUESTS.inc(cache='image', result='miss')
+        image_bytes = prepare_image(response.content, self.max_side, self.jpeg_quality)
+        self._store(image_path, meta_path, image_bytes, {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'checked_at': time.time(),
+        })
+        return image_bytes
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return (
+            os.path.join(self.cache_dir, f"{key}.jpg"),
+            os.path.join(self.cache_dir, f"{key}.json"),
+        )
+
+    @staticmethod
+    def _read_meta(meta_path):
+        try:
+            with open(meta_path, encoding='utf-8') as meta_file:
+                return json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _read_image(image_path):
+        try:
+            with open(image_path, 'rb') as image_file:
+                return image_file.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _touch(image_path):
+        try:
+            os.utime(image_path)
+        except OSError:
+            pass
+
+    def _write_meta(self, meta_path, meta):
+        self._write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+    def _store(self, image_path, meta_path, image_bytes, meta):
+        with self._lock:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self._write_atomic(image_path, image_bytes)
+                self._write_meta(meta_path, meta)
+                self._evict()
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить изображение в кеш: {e}")
+
+    @staticmethod
+    def _write_atomic(path, content):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_path, path)
+
+    def _evict(self):
+        images = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.jpg'):
+                stat = entry.stat()
+                images.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        for _, size, image_path in sorted(images):
+            if total_size <= self.max_bytes:
+                break
+            for path in (image_path, image_path[:-len('.jpg')] + '.json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total_size -= size
@@ -0,0 +1,323 @@
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import redis
+from redis.client import Pipeline
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CALL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+
+def escape_label_value(value):
+    """Экранирует значение метки для текстового формата Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    """Форматирует метки в синтаксисе Prometheus"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + '}'
+
+
+class Metric:
+    """Базовая метрика с набором меток"""
+
+    type_name = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple((name, str(labels.get(name, ''))) for name in self.labelnames)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {'labels': dict(key), **self._snapshot_value(value)}
+                for key, value in sorted(self._values.items())
+            ]
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{format_labels(key)} {value}"]
+
+    def _snapshot_value(self, value):
+        return {'value': value}
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Значение, которое может расти и уменьшаться, например, число запросов в работе"""
+
+    type_name = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Увеличивает значение на время выполнения блока"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    """Гистограмма распределения значений по корзинам"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][position] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Измеряет время выполнения блока"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def _render_value(self, key, value):
+        lines = []
+        for bound, bucket_count in zip(self.buckets, value['buckets']):
+            lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {bucket_count}")
+        lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {value['count']}")
+        lines.append(f"{self.name}_sum{format_labels(key)} {value['sum']}")
+        lines.append(f"{self.name}_count{format_labels(key)} {value['count']}")
+        return lines
+
+    def _snapshot_value(self, value):
+        average = value['sum'] / value['count'] if value['count'] else 0
+        return {'count': value['count'], 'sum': round(value['sum'], 6), 'avg': round(average, 6)}
+
+
+class MetricsRegistry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Возвращает значения всех метрик словарем для структурированных логов"""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+
+REGISTRY = MetricsRegistry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    'bot_handler_seconds', 'Время обработки обновления обработчиком состояния', ['state']
+))
+HANDLERS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'bot_handlers_in_flight', 'Обновления, которые обрабатываются прямо сейчас', ['state']
+))
+UPDATE_CALLS = REGISTRY.register(Histogram(
+    'bot_update_backend_calls', 'Количество обращений к Strapi и Redis за одно обновление',
+    ['backend'], buckets=CALL_COUNT_BUCKETS
+))
+PRODUCT_SERVICE_SECONDS = REGISTRY.register(Histogram(
+    'product_service_seconds', 'Время выполнения функций product_service', ['function']
+))
+STRAPI_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'strapi_request_seconds', 'Время HTTP-запроса к Strapi', ['method', 'endpoint']
+))
+STRAPI_REQUESTS = REGISTRY.register(Counter(
+    'strapi_requests_total', 'Запросы к Strapi по коду ответа', ['method', 'endpoint', 'status']
+))
+STRAPI_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'strapi_requests_in_flight', 'Запросы к Strapi, ожидающие ответа'
+))
+REDIS_CALLS = REGISTRY.register(Counter(
+    'redis_calls_total', 'Обращения к Redis (конвейер считается одним обращением)'
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'cache_requests_total', 'Обращения к кешам по результату', ['cache', 'result']
+))
+OUTBOUND_OPERATIONS = REGISTRY.register(Counter(
+    'telegram_outbound_operations_total', 'Исходящие операции Bot API по результату', ['method', 'result']
+))
+OUTBOUND_QUEUED = REGISTRY.register(Gauge(
+    'telegram_outbound_queued', 'Исходящие операции, ожидающие отправки'
+))
+
+
+_update_calls = threading.local()
+
+
+def start_update_tracking():
+    """Начинает подсчет обращений к Strapi и Redis для обновления в текущем потоке"""
+    _update_calls.counts = {'strapi': 0, 'redis': 0}
+
+
+def finish_update_tracking():
+    """Записывает количество обращений за обновление в гистограмму"""
+    counts = getattr(_update_calls, 'counts', None)
+    _update_calls.counts = None
+    if counts is None:
+        return
+    for backend, calls in counts.items():
+        UPDATE_CALLS.observe(calls, backend=backend)
+
+
+def count_backend_call(backend):
+    """Учитывает обращение к Strapi или Redis"""
+    counts = getattr(_update_calls, 'counts', None)
+    if counts is not None:
+        counts[backend] += 1
+
+
+@contextmanager
+def track_handler(state):
+    """Измеряет время обработчика состояния и учитывает его среди обработчиков в работе"""
+    with HANDLERS_IN_FLIGHT.track(state=state), HANDLER_SECONDS.time(state=state):
+        yield
+
+
+def observe_function(histogram):
+    """Декоратор: измеряет время выполнения функции с меткой function"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(function=func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class InstrumentedPipeline(Pipeline):
+    """Конвейер Redis, который учитывает выполнение как одно обращение"""
+
+    def execute(self, raise_on_error=True):
+        REDIS_CALLS.inc()
+        count_backend_call('redis')
+        return super().execute(raise_on_error)
+
+
+class InstrumentedRedis(redis.Redis):
+    """Клиент Redis, который считает обращения для метрик"""
+
+    def execute_command(self, *args, **options):
+        REDIS_CALLS.inc()
+        count_backend_call('redis')
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics в формате Prometheus"""
+
+    def __init__(self, registry=REGISTRY, listen='127.0.0.1', port=9100):
+        self.registry = registry
+        self.httpd = ThreadingHTTPServer((listen, port), self._create_request_handler())
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        """Запускает сервер в фоновом потоке"""
+        threading.Thread(target=self.httpd.serve_forever, name='metrics', daemon=True).start()
+
+    def shutdown(self):
+        """Останавливает сервер и освобождает сокет"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _create_request_handler(self):
+        server = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                body = server.registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return MetricsRequestHandler
+
+
+def start_metrics_logging(interval, registry=REGISTRY):
+    """Раз в interval секунд пишет значения метрик в лог одной JSON-строкой"""
+    def log_metrics():
+        while True:
+            time.sleep(interval)
+            logger.info(json.dumps({'metrics': registry.snapshot()}, ensure_ascii=False))
+
+    threading.Thread(target=log_metrics, name='metrics-log', daemon=True).start()
@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import product_service
+from update_stream import StreamConsumer
+
+logger = logging.getLogger(__name__)
+
+ENQUEUE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'job', ARGV[4])
+    return {ARGV[1], 1}
+end
+return {redis.call('GET', KEYS[1]), 0}
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class OrderJobFailed(Exception):
+    """Шаг оформления заказа не удался и будет повторен"""
+
+
+class OrderJobQueue:
+    """Очередь заданий на оформление заказа в Redis stream.
+
+    Постановка задания - один вызов Lua-скрипта: ключ дедупликации
+    корзины ставится через SET NX и только тогда задание добавляется в
+    stream. Повторное оформление той же корзины, пока задание не
+    выполнено, возвращает уже поставленное задание.
+    """
+
+    def __init__(self, redis_client, stream='orders', key_prefix='order-job', dedup_ttl=600,
+                 maxlen=100000):
+        self.redis_client = redis_client
+        self.stream = stream
+        self.key_prefix = key_prefix
+        self.dedup_ttl = dedup_ttl
+        self.maxlen = maxlen
+        self._enqueue_script = redis_client.register_script(ENQUEUE_SCRIPT)
+        self._release_script = redis_client.register_script(RELEASE_SCRIPT)
+
+    def dedup_key(self, cart_document_id):
+        return f"{self.key_prefix}:cart:{cart_document_id}"
+
+    def state_key(self, job_id):
+        return f"{self.key_prefix}:{job_id}"
+
+    def enqueue(self, chat_id, tg_id, cart_document_id, email):
+        """Ставит задание в очередь и возвращает (job_id, True) или (job_id уже поставленного, False)"""
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'chat_id': chat_id,
+            'tg_id': tg_id,
+            'cart_document_id': cart_document_id,
+            'email': email,
+        }
+        job_id, is_new = self._enqueue_script(
+            keys=[self.dedup_key(cart_document_id), self.stream],
+            args=[job['job_id'], self.dedup_ttl, self.maxlen, json.dumps(job)]
+        )
+        return job_id, bool(is_new)
+
+    def release(self, job):
+        """Снимает ключ дедупликации корзины, если он принадлежит заданию"""
+        self._release_script(keys=[self.dedup_key(job['cart_document_id'])], args=[job['job_id']])
+
+
+class OrderWorker(StreamConsumer):
+    """Воркер заказов: создает заказ в Strapi, очищает корзину и уведомляет пользователя.
+
+    Первым шагом воркер снимает корзину с ценами из проекции корзины
+    (или из Strapi, если проекции нет). Результат каждого шага (снимок
+    корзины, последний заказ корзины до оформления, созданный заказ,
+    очистка корзины, уведомление) сохраняется в хеше задания, поэтому повтор
+    после ошибки или падения процесса продолжает с невыполненного шага.
+    Перед созданием заказа воркер ищет в Strapi заказ этой корзины новее
+    запомненного, чтобы не создать его дважды; обе метки времени
+    выставляет Strapi. Неудачный шаг повторяется до max_attempts раз с
+    экспоненциальной паузой, после чего вызывается on_failed.
+
+    Перед каждым шагом и попыткой воркер забирает сообщение задания на
+    себя (XCLAIM), сбрасывая время его простоя, поэтому другой воркер
+    заберет задание только если этот не подавал признаков жизни дольше
+    claim_idle_ms. claim_idle_ms должен быть больше самого долгого шага
+    с учетом таймаутов и повторов запросов к Strapi.
+
+    on_done(job, order, cart_content) и on_failed(job, error) отправляют
+    пользователю результат.
+    """
+
+    def __init__(self, redis_client, strapi_client, order_queue, on_done, on_failed,
+                 cart_projection=None, group='order-workers', consumer_name=None, max_workers=4,
+                 max_attempts=5, retry_delay=1, state_ttl=7 * 24 * 3600, batch_size=50, block_ms=5000,
+                 claim_idle_ms=300000):
+        super().__init__(
+            redis_client,
+            order_queue.stream,
+            group,
+            consumer_name or f"{socket.gethostname()}-{os.getpid()}",
+            batch_size=batch_size,
+            block_ms=block_ms,
+            claim_idle_ms=claim_idle_ms
+        )
+        self.strapi_client = strapi_client
+        self.order_queue = order_queue
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.cart_projection = cart_projection
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.state_ttl = state_ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='order-worker')
+        self._in_flight = threading.BoundedSemaphore(max_workers * 2)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def _dispatch(self, message_id, fields):
+        if not fields:
+            self._finish_message(message_id)
+            return
+
+        self._in_flight.acquire()
+        self.executor.submit(self._process, message_id, fields)
+
+    def _process(self, message_id, fields):
+        try:
+            job = json.loads(fields['job'])
+        except (KeyError, ValueError):
+            logger.exception(f"Некорректное задание заказа {message_id}")
+            self._finish_message(message_id)
+            self._in_flight.release()
+            return
+
+        status = None
+        try:
+            status = self.process_job(job, message_id)
+        except Exception:
+            logger.exception(f"Ошибка обработки задания заказа {job['job_id']}")
+        finally:
+            self._finish_message(message_id, ack=status in ('done', 'failed'))
+            self._in_flight.release()
+
+    def process_job(self, job, message_id=None):
+        """Выполняет задание, повторяя неудачные шаги, и возвращает его итоговый статус.
+
+        Если выполнение прервано ошибкой Redis, сообщение задания остается
+        неподтвержденным и через claim_idle_ms будет доставлено снова.
+        """
+        state_key = self.order_queue.state_key(job['job_id'])
+        state = self.redis_client.hgetall(state_key)
+        if state.get('status') in ('done', 'failed'):
+            return state['status']
+
+        attempt = int(state.get('attempts', 0))
+        while True:
+            try:
+                self._run_steps(job, state_key, state, message_id)
+                break
+            except Exception as e:
+                attempt = self.redis_client.hincrby(state_key, 'attempts', 1)
+                if attempt >= self.max_attempts:
+                    logger.error(f"Задание заказа {job['job_id']} не выполнено: {e}")
+                    self._finish(job, state_key, 'failed')
+                    if self.cart_projection is not None:
+                        self.cart_projection.invalidate(job['tg_id'])
+                    self.on_failed(job, e)
+                    return 'failed'
+                logger.warning(f"Шаг задания заказа {job['job_id']} не удался, попытка {attempt}: {e}")
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+                self._touch(message_id)
+
+        self._finish(job, state_key, 'done')
+        return 'done'
+
+    def _run_steps(self, job, state_key, state, message_id):
+        if 'cart' not in state:
+            self._touch(message_id)
+            self._save_step(state_key, state, 'cart', json.dumps(self._get_cart_content(job)))
+        cart_content = json.loads(state['cart'])
+
+        if 'last_order' not in state:
+            self._touch(message_id)
+            last_order = product_service.find_order(self.strapi_client, job['cart_document_id'])
+            self._save_step(state_key, state, 'last_order', last_order['createdAt'] if last_order else '')
+
+        if 'order' not in state:
+            self._touch(message_id)
+            order = product_service.find_order(
+                self.strapi_client, job['cart_document_id'], state['last_order'] or None
+            )
+            if order is None:
+                order = product_service.create_order(
+                    self.strapi_client, job['cart_document_id'], job['email']
+                )
+            self._save_step(state_key, state, 'order', json.dumps(order))
+        order = json.loads(state['order'])
+
+        if 'cleared' not in state:
+            self._touch(message_id)
+            failed_ids = product_service.delete_cart_products(
+                self.strapi_client, [item['cart_product_id'] for item in cart_content['items']]
+            )
+            if failed_ids:
+                raise OrderJobFailed(f"не удалось удалить позиции корзины {failed_ids}")
+            if self.cart_projection is not None:
+                self.cart_projection.clear(job['tg_id'])
+            self._save_step(state_key, state, 'cleared', '1')
+
+        if 'notified' not in state:
+            self._touch(message_id)
+            self.on_done(job, order, cart_content)
+            self._save_step(state_key, state, 'notified', '1')
+
+    def _get_cart_content(self, job):
+        if self.cart_projection is not None:
+            return self.cart_projection.get(job['tg_id'], job['cart_document_id'])
+        return product_service.get_cart_content_with_details(self.strapi_client, job['cart_document_id'])
+
+    def _touch(self, message_id):
+        """Сбрасывает время простоя сообщения задания, чтобы его не забрал другой воркер"""
+        if message_id is not None:
+            self.redis_client.xclaim(
+                self.stream, self.group, self.consumer_name, 0, [message_id], justid=True
+            )
+
+    def _save_step(self, state_key, state, step, value):
+        pipeline = self.redis_client.pipeline()
+        pipeline.hset(state_key, step, value)
+        pipeline.expire(state_key, self.state_ttl)
+        pipeline.execute()
+        state[step] = value
+
+    def _finish(self, job, state_key, status):
+        pipeline = self.redis_client.pipeline()
+        pipeline.hset(state_key, 'status', status)
+        pipeline.expire(state_key, self.state_ttl)
+        pipeline.execute()
+        self.order_queue.release(job)
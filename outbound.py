@@ -0,0 +1,326 @@
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telegram.error import BadRequest, RetryAfter
+
+from metrics import OUTBOUND_OPERATIONS, OUTBOUND_QUEUED
+
+logger = logging.getLogger(__name__)
+
+EDIT_METHODS = ('edit_message_text', 'edit_message_reply_markup')
+BUCKET_CLEANUP_INTERVAL = 60
+
+
+def is_not_modified(error):
+    """Проверяет, что Telegram отклонил правку, потому что сообщение не изменилось"""
+    return 'message is not modified' in str(error).lower()
+
+
+def execute_operation(bot, operation):
+    """Выполняет операцию отправки через Bot API и возвращает ее результат"""
+    method = operation['method']
+    kwargs = operation['kwargs']
+
+    if method == 'call':
+        return operation['func'](bot, *operation['args'])
+
+    if method == 'replace_message':
+        try:
+            return bot.edit_message_text(
+                chat_id=operation['chat_id'], message_id=operation['message_id'], **kwargs
+            )
+        except BadRequest as e:
+            if is_not_modified(e):
+                return None
+            logger.info(f"Сообщение нельзя отредактировать, отправляем заново: {e}")
+        try:
+            bot.delete_message(chat_id=operation['chat_id'], message_id=operation['message_id'])
+        except Exception as e:
+            logger.warning(f"Не удалось удалить сообщение: {e}")
+        return bot.send_message(chat_id=operation['chat_id'], **kwargs)
+
+    if operation['message_id'] is not None:
+        kwargs = {'message_id': operation['message_id'], **kwargs}
+    try:
+        return getattr(bot, method)(chat_id=operation['chat_id'], **kwargs)
+    except BadRequest as e:
+        if method in EDIT_METHODS and is_not_modified(e):
+            return None
+        raise
+
+
+class TokenBucket:
+    """Ведро токенов: в среднем rate операций в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self):
+        """Забирает токен и возвращает 0 или, если токенов нет, сколько секунд ждать следующего"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class BotSender:
+    """Отправка сообщений через Bot API сразу в вызывающем потоке.
+
+    Используется, когда очередь исходящих сообщений не настроена:
+    интерфейс тот же, что у OutboundQueue, но каждая операция выполняется
+    синхронно, а ошибка только логируется и сохраняется в Future.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._submit(self._operation('send_message', chat_id, text=text, **kwargs))
+
+    def delete_message(self, chat_id, message_id):
+        return self._submit(self._operation('delete_message', chat_id, message_id))
+
+    def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        return self._submit(self._operation('edit_message_text', chat_id, message_id, text=text, **kwargs))
+
+    def edit_message_reply_markup(self, chat_id, message_id, reply_markup):
+        return self._submit(self._operation(
+            'edit_message_reply_markup', chat_id, message_id, reply_markup=reply_markup
+        ))
+
+    def replace_message(self, chat_id, message_id, text, **kwargs):
+        """Заменяет текстовое сообщение новым: правит его на месте вместо удаления и повторной отправки.
+
+        Если сообщение нельзя отредактировать (например, это фото), оно
+        удаляется и отправляется новое.
+        """
+        return self._submit(self._operation('replace_message', chat_id, message_id, text=text, **kwargs))
+
+    def call(self, chat_id, func, *args):
+        """Выполняет func(bot, *args) как одну операцию отправки в чат"""
+        operation = self._operation('call', chat_id)
+        operation['func'] = func
+        operation['args'] = args
+        return self._submit(operation)
+
+    @staticmethod
+    def _operation(method, chat_id, message_id=None, **kwargs):
+        return {
+            'method': method,
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'kwargs': kwargs,
+            'futures': [Future()],
+            'attempts': 0,
+        }
+
+    def _submit(self, operation):
+        future = operation['futures'][0]
+        try:
+            result = execute_operation(self.bot, operation)
+        except Exception as e:
+            OUTBOUND_OPERATIONS.inc(method=operation['method'], result='failed')
+            logger.warning(f"Не удалось выполнить {operation['method']} в чате {operation['chat_id']}: {e}")
+            future.set_exception(e)
+        else:
+            OUTBOUND_OPERATIONS.inc(method=operation['method'], result='sent')
+            future.set_result(result)
+        return future
+
+
+class OutboundQueue(BotSender):
+    """Очередь исходящих сообщений с учетом лимитов Telegram.
+
+    Обработчики только ставят операции в очередь и сразу возвращаются,
+    отправку выполняет пул из max_workers потоков. Все вызовы Bot API
+    ограничены общим ведром токенов (global_rate в секунду), отправка и
+    правка сообщений в один чат - ведром чата (chat_rate в секунду,
+    до chat_burst подряд). Операции одного чата выполняются по порядку,
+    разные чаты - параллельно. При ответе 429 (RetryAfter) чат
+    приостанавливается на указанное Telegram время и операция повторяется
+    до max_retries раз.
+
+    Пока операция ждет в очереди, она может быть объединена с новой:
+    несколько правок одного сообщения сводятся к последней, а правки
+    сообщения, которое затем удаляется, отбрасываются.
+    """
+
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, max_workers=8, max_retries=3):
+        super().__init__(bot)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='outbound')
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._global_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._queues = {}
+        self._chat_buckets = {}
+        self._timers = []
+        self._closed = False
+        self._scheduler = threading.Thread(target=self._run_scheduler, name='outbound-scheduler', daemon=True)
+        self._scheduler.start()
+
+    def close(self, timeout=10):
+        """Дожидается отправки поставленных операций (не дольше timeout секунд) и останавливает очередь"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._queues and time.monotonic() < deadline:
+                self._condition.wait(min(0.1, max(deadline - time.monotonic(), 0)))
+            if self._queues:
+                logger.warning(f"Остались неотправленные сообщения в {len(self._queues)} чатах")
+            self._closed = True
+            self._condition.notify_all()
+        self._executor.shutdown(wait=True)
+
+    def _submit(self, operation):
+        future = operation['futures'][0]
+        chat_id = operation['chat_id']
+        with self._condition:
+            queue = self._queues.get(chat_id)
+            if queue is None:
+                self._queues[chat_id] = deque([operation])
+                OUTBOUND_QUEUED.inc()
+                self._executor.submit(self._drain, chat_id)
+            elif not self._coalesce(queue, operation):
+                queue.append(operation)
+                OUTBOUND_QUEUED.inc()
+        return future
+
+    def _coalesce(self, queue, operation):
+        """Объединяет операцию с ожидающими в очереди чата, возвращает True, если она поглощена"""
+        method = operation['method']
+        message_id = operation['message_id']
+
+        if method == 'delete_message':
+            for pending in [pending for pending in queue if self._is_edit_of(pending, message_id)]:
+                queue.remove(pending)
+                self._resolve(pending, None, 'coalesced')
+                OUTBOUND_QUEUED.dec()
+            return False
+
+        if method not in EDIT_METHODS:
+            return False
+
+        for pending in reversed(queue):
+            if pending['method'] == 'delete_message' and pending['message_id'] == message_id:
+                self._resolve(operation, None, 'coalesced')
+                return True
+            if not self._is_edit_of(pending, message_id):
+                continue
+
+            if method == 'edit_message_reply_markup' and pending['method'] == 'edit_message_text':
+                pending['kwargs']['reply_markup'] = operation['kwargs']['reply_markup']
+            else:
+                pending['method'] = method
+                pending['kwargs'] = operation['kwargs']
+            pending['futures'].extend(operation['futures'])
+            OUTBOUND_OPERATIONS.inc(method=method, result='coalesced')
+            return True
+        return False
+
+    @staticmethod
+    def _is_edit_of(operation, message_id):
+        return operation['method'] in EDIT_METHODS and operation['message_id'] == message_id
+
+    @staticmethod
+    def _resolve(operation, result, status):
+        OUTBOUND_OPERATIONS.inc(method=operation['method'], result=status)
+        for future in operation['futures']:
+            future.set_result(result)
+
+    def _drain(self, chat_id):
+        while True:
+            with self._condition:
+                queue = self._queues[chat_id]
+                if not queue:
+                    del self._queues[chat_id]
+                    self._condition.notify_all()
+                    return
+
+                if queue[0]['method'] != 'delete_message':
+                    bucket = self._chat_buckets.get(chat_id)
+                    if bucket is None:
+                        bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+                    delay = bucket.take()
+                    if delay:
+                        self._schedule(chat_id, delay)
+                        return
+                operation = queue.popleft()
+                OUTBOUND_QUEUED.dec()
+
+            self._acquire_global()
+            try:
+                result = execute_operation(self.bot, operation)
+            except RetryAfter as e:
+                if operation['attempts'] < self.max_retries:
+                    operation['attempts'] += 1
+                    OUTBOUND_OPERATIONS.inc(method=operation['method'], result='retried')
+                    logger.warning(f"Telegram ограничил отправку в чат {chat_id} на {e.retry_after} с")
+                    with self._condition:
+                        self._queues[chat_id].appendleft(operation)
+                        OUTBOUND_QUEUED.inc()
+                        self._schedule(chat_id, e.retry_after)
+                    return
+                self._fail(operation, e)
+            except Exception as e:
+                self._fail(operation, e)
+            else:
+                self._resolve(operation, result, 'sent')
+
+    def _fail(self, operation, error):
+        OUTBOUND_OPERATIONS.inc(method=operation['method'], result='failed')
+        logger.warning(f"Не удалось выполнить {operation['method']} в чате {operation['chat_id']}: {error}")
+        for future in operation['futures']:
+            future.set_exception(error)
+
+    def _acquire_global(self):
+        while True:
+            with self._global_lock:
+                delay = self._global_bucket.take()
+            if not delay:
+                return
+            time.sleep(delay)
+
+    def _schedule(self, chat_id, delay):
+        heapq.heappush(self._timers, (time.monotonic() + delay, chat_id))
+        self._condition.notify_all()
+
+    def _run_scheduler(self):
+        next_cleanup_at = time.monotonic() + BUCKET_CLEANUP_INTERVAL
+        with self._condition:
+            while not self._closed:
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    _, chat_id = heapq.heappop(self._timers)
+                    self._executor.submit(self._drain, chat_id)
+
+                if now >= next_cleanup_at:
+                    for chat_id in [
+                        chat_id for chat_id, bucket in self._chat_buckets.items()
+                        if chat_id not in self._queues and bucket.is_full()
+                    ]:
+                        del self._chat_buckets[chat_id]
+                    next_cleanup_at = now + BUCKET_CLEANUP_INTERVAL
+
+                timeout = next_cleanup_at - now
+                if self._timers:
+                    timeout = min(timeout, self._timers[0][0] - now)
+                self._condition.wait(timeout)
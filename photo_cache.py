@@ -0,0 +1,56 @@
+import logging
+
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoFileIdCache:
+    """Хранит в Redis file_id фотографий продуктов, уже загруженных в Telegram.
+
+    Запись привязана к версии изображения (hash и updatedAt из Strapi):
+    если картинка продукта поменялась, старый file_id считается устаревшим
+    и удаляется при следующем обращении.
+    """
+
+    def __init__(self, redis_client, key_prefix='photo_file_id'):
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+
+    def _key(self, document_id):
+        return f"{self.key_prefix}:{document_id}"
+
+    def get(self, document_id, picture_version):
+        """Возвращает file_id для текущей версии изображения или None"""
+        try:
+            entry = self.redis_client.hgetall(self._key(document_id))
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать file_id из Redis: {e}")
+            return None
+
+        if not entry:
+            CACHE_REQUESTS.inc(cache='photo_file_id', result='miss')
+            return None
+        if entry.get('version') != picture_version:
+            CACHE_REQUESTS.inc(cache='photo_file_id', result='outdated')
+            self.invalidate(document_id)
+            return None
+        CACHE_REQUESTS.inc(cache='photo_file_id', result='hit')
+        return entry.get('file_id')
+
+    def set(self, document_id, picture_version, file_id):
+        """Запоминает file_id, который Telegram вернул после загрузки фото"""
+        try:
+            self.redis_client.hmset(
+                self._key(document_id),
+                {'version': picture_version, 'file_id': file_id}
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить file_id в Redis: {e}")
+
+    def invalidate(self, document_id):
+        """Удаляет сохраненный file_id продукта"""
+        try:
+            self.redis_client.delete(self._key(document_id))
+        except Exception as e:
+            logger.warning(f"Не удалось удалить file_id из Redis: {e}")
@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+def prewarm_caches(catalog_cache, product_cache, image_cache=None, photo_cache=None,
+                   search_index=None, max_workers=8, time_budget=30):
+    """Заполняет кеши до начала приема обновлений.
+
+    Загружает все страницы каталога, карточки продуктов и их изображения
+    не более чем в max_workers потоков. Изображение не скачивается, если
+    для текущей версии картинки уже сохранен file_id Telegram. Через
+    time_budget секунд незавершенные задачи отменяются, а бот стартует
+    с тем, что успело загрузиться.
+    """
+    started_at = time.monotonic()
+    deadline = started_at + time_budget
+    stats = {'pages': 0, 'products': 0, 'images': 0, 'errors': 0}
+    lock = threading.Lock()
+    pending = set()
+    queued_products = set()
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prewarm')
+
+    def submit(func, *args):
+        with lock:
+            pending.add(executor.submit(func, *args))
+
+    def count(name):
+        with lock:
+            stats[name] += 1
+
+    def load_page(page):
+        _, catalog_page = catalog_cache.get(page)
+        count('pages')
+        if page == 1:
+            last_page = min(catalog_page['page_count'], catalog_cache.max_pages)
+            for next_page in range(2, last_page + 1):
+                submit(load_page, next_page)
+
+        for product in catalog_page['products']:
+            with lock:
+                if len(queued_products) >= product_cache.max_size:
+                    return
+                queued_products.add(product['documentId'])
+            submit(load_product, product['documentId'])
+
+    def load_product(document_id):
+        product = product_cache.get(document_id)
+        count('products')
+        if image_cache is None or not product['picture_urls']:
+            return
+        if photo_cache is not None and photo_cache.get(document_id, product['picture_version']):
+            return
+        image_cache.get(product['picture_urls'][0])
+        count('images')
+
+    submit(load_page, 1)
+    if search_index is not None:
+        submit(lambda: search_index.update(search_index.loader()))
+
+    try:
+        while True:
+            with lock:
+                running = set(pending)
+            if not running:
+                break
+
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                logger.warning(f"Прогрев не уложился в {time_budget} с, пропущено задач: {len(running)}")
+                break
+
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                with lock:
+                    pending.discard(future)
+                error = future.exception()
+                if error is not None:
+                    count('errors')
+                    logger.warning(f"Ошибка прогрева кеша: {error}")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.monotonic() - started_at
+    logger.info(
+        f"Прогрев кешей за {elapsed:.2f} с: страниц {stats['pages']}, "
+        f"продуктов {stats['products']}, изображений {stats['images']}, ошибок {stats['errors']}"
+    )
+    return stats
@@ -1,118 +1,214 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
 
+from metrics import PRODUCT_SERVICE_SECONDS, observe_function
+
+logger = logging.getLogger(__name__)
+
+# Формы запросов к Strapi: каждая операция запрашивает только те поля
+# и связи, которые использует. documentId Strapi возвращает всегда.
+CATALOG_PAGE_SIZE = 10
+
+CATALOG_PARAMS = {
+    "fields[0]": "title",
+    "sort[0]": "title:asc",
+}
+
+SEARCH_PAGE_SIZE = 100
+
+SEARCH_PARAMS = {
+    "fields[0]": "title",
+    "fields[1]": "description",
+    "fields[2]": "price",
+}
+
+PRODUCT_DETAILS_PARAMS = {
+    "fields[0]": "title",
+    "fields[1]": "price",
+    "fields[2]": "description",
+    "populate[picture][fields][0]": "url",
+    "populate[picture][fields][1]": "hash",
+    "populate[picture][fields][2]": "updatedAt",
+}
+
+CART_LOOKUP_PARAMS = {
+    "fields[0]": "tg_id",
+}
+
+CART_CONTENT_PARAMS = {
+    "fields[0]": "tg_id",
+    "populate[cart_products][fields][0]": "quantity",
+    "populate[cart_products][populate][product][fields][0]": "title",
+    "populate[cart_products][populate][product][fields][1]": "price",
+}
+
+CART_PRODUCT_PARAMS = {
+    "fields[0]": "quantity",
+    "populate[product][fields][0]": "title",
+    "populate[product][fields][1]": "price",
+}
+
+CART_PRODUCT_IDS_PARAMS = {
+    "fields[0]": "tg_id",
+    "populate[cart_products][fields][0]": "quantity",
+}
+
+CART_PRODUCT_LOOKUP_PARAMS = {
+    "fields[0]": "quantity",
+}
+
+ORDER_LOOKUP_PARAMS = {
+    "fields[0]": "email",
+    "fields[1]": "createdAt",
+    "sort[0]": "createdAt:desc",
+    "pagination[pageSize]": 1,
+}
+
+
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def get_catalog_page(strapi_client, page=1, page_size=CATALOG_PAGE_SIZE):
+    """Получает одну страницу каталога через пагинацию Strapi"""
+    product_entities = strapi_client.get(
+        "/api/products",
+        params=build_catalog_page_params(page, page_size)
+    )
+    return build_catalog_page(product_entities, page)
+
 
-def create_headers(strapi_token):
-    """Создает заголовки для запросов"""
+def build_catalog_page_params(page, page_size):
+    """Собирает параметры запроса страницы каталога"""
     return {
-        "Authorization": f"Bearer {strapi_token}",
-        "Content-Type": "application/json"
+        **CATALOG_PARAMS,
+        "pagination[page]": page,
+        "pagination[pageSize]": page_size,
     }
 
 
-def get_fishes_from_strapi(strapi_url, strapi_token):
-    """Отправляет запрос к API и в ответ получает список продуктов"""
-    headers = {"Authorization": f"Bearer {strapi_token}"}
-    response = requests.get(
-        f"{strapi_url}/api/products",
-        headers=headers,
-        params={"populate": "*"}
-    )
-    response.raise_for_status()
-    product_entities = response.json()
-    return product_entities['data']
-
-
-def get_description_from_strapi(strapi_url, strapi_token, document_id):
-    """Получает данные о продукте из CMS Strapi"""
-    headers = {"Authorization": f"Bearer {strapi_token}"}
-    response = requests.get(
-        f"{strapi_url}/api/products/{document_id}",
-        headers=headers,
-        params={"populate": "*"}
+def build_catalog_page(product_entities, page):
+    """Собирает страницу каталога из ответа Strapi"""
+    pagination = product_entities.get('meta', {}).get('pagination', {})
+    return {
+        'products': product_entities['data'],
+        'page': pagination.get('page', page),
+        'page_count': max(pagination.get('pageCount', 1), 1),
+    }
+
+
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def get_searchable_products(strapi_client, page_size=SEARCH_PAGE_SIZE):
+    """Получает все продукты с полями для поиска, проходя по страницам Strapi"""
+    products = []
+    page = 1
+    while True:
+        product_entities = strapi_client.get(
+            "/api/products",
+            params={**SEARCH_PARAMS, "pagination[page]": page, "pagination[pageSize]": page_size}
+        )
+        products.extend(product_entities['data'])
+        catalog_page = build_catalog_page(product_entities, page)
+        if page >= catalog_page['page_count'] or not product_entities['data']:
+            return products
+        page += 1
+
+
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def get_product_details(strapi_client, document_id):
+    """Получает все данные карточки продукта из CMS Strapi одним запросом"""
+    product_entities = strapi_client.get(
+        f"/api/products/{document_id}",
+        params=PRODUCT_DETAILS_PARAMS
     )
-    response.raise_for_status()
-    product_entities = response.json()
-    product = product_entities['data']
+    return build_product_details(strapi_client, document_id, product_entities['data'])
+
+
+def build_product_details(strapi_client, document_id, product):
+    """Собирает карточку продукта из ответа Strapi"""
+    pictures = product.get('picture') or []
+    picture_urls = []
+    for picture in pictures:
+        picture_url = picture.get('url')
+        if picture_url:
+            picture_urls.append(strapi_client.build_url(picture_url))
+
+    picture_version = None
+    if pictures:
+        first_picture = pictures[0]
+        picture_version = (
+            f"{first_picture.get('hash') or first_picture.get('url')}:"
+            f"{first_picture.get('updatedAt', '')}"
+        )
 
-    title = product.get('title', 'Без названия')
-    price = product.get('price', 0)
-    description = product.get('description', 'Описание отсутствует')
+    return {
+        'document_id': document_id,
+        'title': product.get('title', 'Без названия'),
+        'price': product.get('price', 0),
+        'description': product.get('description', 'Описание отсутствует'),
+        'picture_urls': picture_urls,
+        'picture_version': picture_version
+    }
 
-    message = f'{title}    Цена: {price} руб.\n\n'
-    message += f'{description}'
-    return message
 
+def format_product_description(product):
+    """Формирует текст карточки продукта"""
+    message = f"{product['title']}    Цена: {product['price']} руб.\n\n"
+    message += f"{product['description']}"
+    return message
 
-def get_picture_bytes_from_strapi(strapi_url, strapi_token, document_id):
-    """Получает URL изображения продукта из CMS Strapi"""
-    headers = {"Authorization": f"Bearer {strapi_token}"}
-    response = requests.get(
-        f"{strapi_url}/api/products/{document_id}",
-        headers=headers,
-        params={"populate": "*"}
-    )
-    response.raise_for_status()
-    product_entities = response.json()
-    pictures = product_entities['data'].get('picture', [])
 
-    if not pictures:
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def get_picture_bytes(strapi_client, product):
+    """Скачивает первое изображение продукта, если оно есть"""
+    if not product['picture_urls']:
         return None
+    return strapi_client.get_bytes(product['picture_urls'][0])
 
-    first_picture = pictures[0]
-    picture_url = first_picture.get('url')
 
-    if picture_url:
-        if picture_url.startswith('/'):
-            picture_url = f"{strapi_url}{picture_url}"
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def get_or_create_cart(strapi_client, tg_id):
+    """Получает идентификатор корзины пользователя по его Telegram ID"""
+    carts_entities = strapi_client.get(
+        "/api/carts",
+        params={**CART_LOOKUP_PARAMS, "filters[tg_id][$eq]": tg_id}
+    )
 
-    image_response = requests.get(picture_url, headers=headers)
-    image_response.raise_for_status()
-    return image_response.content
+    if carts_entities.get('data'):
+        cart = carts_entities['data'][0]
+        return cart['documentId']
 
+    carts_entities = {
+        "data": {
+            "tg_id": tg_id,
+        }
+    }
+    cart = strapi_client.post("/api/carts", carts_entities)['data']
+    return cart['documentId']
 
-def get_or_create_cart(strapi_url, strapi_token, tg_id):
-    """Получает идентификатор корзины пользователя по его Telegram ID"""
-    headers = create_headers(strapi_token)
 
-    response = requests.get(
-        f"{strapi_url}/api/carts",
-        headers=headers,
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def add_cart_product(strapi_client, cart_document_id, product_document_id, quantity):
+    """Добавляет продукт в корзину, увеличивая количество уже добавленной позиции"""
+    cart_products = strapi_client.get(
+        "/api/cart-products",
         params={
-            "filters[tg_id][$eq]": tg_id,
+            **CART_PRODUCT_LOOKUP_PARAMS,
+            "filters[cart][documentId][$eq]": cart_document_id,
+            "filters[product][documentId][$eq]": product_document_id,
         }
-    )
-    response.raise_for_status()
-    cart_document_id = None
-
-    if response.status_code == 200:
-        carts_entities = response.json()
-        if carts_entities.get('data') and len(carts_entities['data']) > 0:
-            cart = carts_entities['data'][0]
-            cart_document_id = cart['documentId']
-            return cart_document_id
-
-    if not cart_document_id:
-        carts_entities = {
+    )["data"]
+
+    if cart_products:
+        cart_product = cart_products[0]
+        updated_cart_product = {
             "data": {
-                "tg_id": tg_id,
+                "quantity": cart_product.get('quantity', 0) + quantity
             }
         }
-
-        response = requests.post(
-            f"{strapi_url}/api/carts",
-            headers=headers,
-            json=carts_entities
-        )
-        response.raise_for_status()
-
-        cart = response.json()['data']
-        cart_document_id = cart['documentId']
-        return cart_document_id
-
-
-def add_cart_product(strapi_url, strapi_token, cart_document_id, product_document_id, quantity):
-    """Добавляет продукт в существующую корзину пользователя"""
-    headers = create_headers(strapi_token)
+        return strapi_client.put(
+            f"/api/cart-products/{cart_product['documentId']}",
+            updated_cart_product
+        )['data']
 
     cart_product = {
         "data": {
@@ -125,55 +221,65 @@ def add_cart_product(strapi_url, strapi_token, cart_document_id, product_documen
             }
         }
     }
-    response = requests.post(
-        f"{strapi_url}/api/cart-products",
-        headers=headers,
-        json=cart_product
-    )
-    response.raise_for_status()
+    return strapi_client.post("/api/cart-products", cart_product)['data']
+
+
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def get_cart_content_with_details(strapi_client, cart_document_id, max_workers=4):
+    """Получает содержимое корзины пользователя вместе с продуктами одним запросом"""
+    cart_entities = strapi_client.get(
+        f"/api/carts/{cart_document_id}",
+        params=CART_CONTENT_PARAMS
+    )["data"]
+    cart_products = select_cart_products(cart_entities)
+
+    missing_ids = [
+        cart_product['documentId'] for cart_product in cart_products
+        if cart_product.get('product') is None
+    ]
+    missing_products = {}
+    if missing_ids:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing_ids))) as executor:
+            fetched = executor.map(
+                lambda cart_product_id: get_cart_product(strapi_client, cart_product_id),
+                missing_ids
+            )
+            for cart_product_id, cart_product in zip(missing_ids, fetched):
+                missing_products[cart_product_id] = cart_product.get('product')
 
+    return build_cart_content(cart_products, missing_products)
 
-def get_cart_content_with_details(strapi_url, strapi_token, cart_document_id):
-    """Получает содержимое корзины пользователя"""
-    headers = create_headers(strapi_token)
 
-    cart_response = requests.get(
-        f"{strapi_url}/api/carts/{cart_document_id}",
-        headers=headers,
-        params={"populate": "*"}
-    )
-    cart_response.raise_for_status()
-    cart_entities = cart_response.json()["data"]
+def select_cart_products(cart_entities):
+    """Отбирает из корзины позиции с положительным количеством"""
+    return [
+        cart_product for cart_product in cart_entities.get('cart_products') or []
+        if cart_product.get('documentId') and cart_product.get('quantity', 0) > 0
+    ]
 
+
+def build_cart_content(cart_products, missing_products):
+    """Считает позиции и итоговую сумму корзины"""
     items = []
     total_sum = 0
 
-    for cart_product in cart_entities.get('cart_products', []):
-        product_document_id = cart_product.get('documentId')
-        quantity = cart_product.get('quantity', 0)
-        cart_product_id = cart_product.get('documentId')
-
-        if product_document_id and quantity > 0:
-            product_response = requests.get(
-                f"{strapi_url}/api/cart-products/{product_document_id}",
-                headers=headers,
-                params={"populate": "*"}
-            )
-            product_response.raise_for_status()
-            product_data = product_response.json()["data"]["product"]
-
-            title = product_data.get('title', 'Неизвестный товар')
-            price = float(product_data.get('price', 0))
-            item_total = price * quantity
-
-            items.append({
-                'title': title,
-                'quantity': quantity,
-                'price': price,
-                'total': item_total,
-                'cart_product_id': cart_product_id
-            })
-            total_sum += item_total
+    for cart_product in cart_products:
+        cart_product_id = cart_product['documentId']
+        quantity = cart_product['quantity']
+        product_data = cart_product.get('product') or missing_products.get(cart_product_id) or {}
+
+        title = product_data.get('title', 'Неизвестный товар')
+        price = float(product_data.get('price', 0))
+        item_total = price * quantity
+
+        items.append({
+            'title': title,
+            'quantity': quantity,
+            'price': price,
+            'total': item_total,
+            'cart_product_id': cart_product_id
+        })
+        total_sum += item_total
 
     return {
         'items': items,
@@ -181,47 +287,78 @@ def get_cart_content_with_details(strapi_url, strapi_token, cart_document_id):
     }
 
 
-def delete_cart_product(strapi_url, strapi_token, cart_product_id):
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def get_cart_product(strapi_client, cart_product_id):
+    """Получает позицию корзины вместе с продуктом"""
+    return strapi_client.get(
+        f"/api/cart-products/{cart_product_id}",
+        params=CART_PRODUCT_PARAMS
+    )["data"]
+
+
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def delete_cart_product(strapi_client, cart_product_id):
     """Удаляет продукт из корзины"""
-    headers = {"Authorization": f"Bearer {strapi_token}"}
-    response = requests.delete(
-        f"{strapi_url}/api/cart-products/{cart_product_id}",
-        headers=headers
-    )
-    response.raise_for_status()
+    response = strapi_client.delete(f"/api/cart-products/{cart_product_id}")
     return response.status_code == 200
 
 
-def clear_cart(strapi_url, strapi_token, tg_id):
-    """Очищает всю корзину пользователя"""
-    headers = create_headers(strapi_token)
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def delete_cart_products(strapi_client, cart_product_ids, max_workers=8):
+    """Удаляет позиции корзины параллельно и возвращает те, что удалить не удалось.
 
-    response = requests.get(
-        f"{strapi_url}/api/carts",
-        headers=headers,
-        params={"filters[tg_id][$eq]": tg_id, "populate": "cart_products"}
-    )
-    response.raise_for_status()
+    Повторы с паузой при сетевых ошибках и ответах 429/5xx выполняет
+    адаптер StrapiClient, уже удаленная позиция (404) считается удаленной.
+    """
+    cart_product_ids = list(cart_product_ids)
+    if not cart_product_ids:
+        return []
+
+    failed_ids = []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(cart_product_ids))) as executor:
+        futures = {
+            executor.submit(delete_cart_product, strapi_client, cart_product_id): cart_product_id
+            for cart_product_id in cart_product_ids
+        }
+        for future in as_completed(futures):
+            cart_product_id = futures[future]
+            try:
+                future.result()
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    continue
+                logger.warning(f"Не удалось удалить позицию {cart_product_id}: {e}")
+                failed_ids.append(cart_product_id)
+            except requests.RequestException as e:
+                logger.warning(f"Не удалось удалить позицию {cart_product_id}: {e}")
+                failed_ids.append(cart_product_id)
+
+    return failed_ids
+
+
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def clear_cart(strapi_client, tg_id):
+    """Очищает всю корзину пользователя"""
+    carts = strapi_client.get(
+        "/api/carts",
+        params={**CART_PRODUCT_IDS_PARAMS, "filters[tg_id][$eq]": tg_id}
+    )["data"]
 
-    carts = response.json()["data"]
     if not carts:
         return True
 
     cart = carts[0]
-    cart_products = cart.get('cart_products', [])
+    cart_product_ids = [
+        cart_product['documentId'] for cart_product in cart.get('cart_products', [])
+        if cart_product.get('documentId')
+    ]
 
-    for cart_product in cart_products:
-        cart_product_id = cart_product.get('documentId')
-        if cart_product_id:
-            delete_cart_product(strapi_url, strapi_token, cart_product_id)
-
-    return True
+    return not delete_cart_products(strapi_client, cart_product_ids)
 
 
-def create_order(strapi_url, strapi_token, cart_document_id, email):
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def create_order(strapi_client, cart_document_id, email):
     """Создает заказ в Strapi"""
-    headers = create_headers(strapi_token)
-
     order_data = {
         "data": {
             "email": email,
@@ -231,10 +368,14 @@ def create_order(strapi_url, strapi_token, cart_document_id, email):
         }
     }
 
-    response = requests.post(
-        f"{strapi_url}/api/orders",
-        headers=headers,
-        json=order_data
-    )
-    response.raise_for_status()
-    return response.json()['data']
\ No newline at end of file
+    return strapi_client.post("/api/orders", order_data)['data']
+
+
+@observe_function(PRODUCT_SERVICE_SECONDS)
+def find_order(strapi_client, cart_document_id, created_after=None):
+    """Ищет последний заказ корзины, созданный позже created_after (createdAt из Strapi)"""
+    params = {**ORDER_LOOKUP_PARAMS, "filters[cart][documentId][$eq]": cart_document_id}
+    if created_after:
+        params["filters[createdAt][$gt]"] = created_after
+    orders = strapi_client.get("/api/orders", params=params)["data"]
+    return orders[0] if orders else None
@@ -1,209 +1,546 @@
+import hashlib
 import logging
+import math
+import threading
 import redis
+import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from environs import env
+from environs import env, validate
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Filters, Updater
-from telegram.ext import CallbackQueryHandler, CommandHandler, MessageHandler
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+from telegram.error import BadRequest
+from telegram.ext import Filters, TypeHandler, Updater
+from telegram.ext import CallbackQueryHandler, CommandHandler, InlineQueryHandler, MessageHandler
 
 import product_service
+from cart_store import CartIdCache, CartProjection
+from catalog_cache import CatalogCache, ProductCache
+from catalog_events import CatalogInvalidator, StrapiWebhookServer
+from dispatching import ChatOrderedExecutor, WebhookServer, create_ordered_handler
+from image_cache import ImageCache
+from metrics import (
+    OUTBOUND_OPERATIONS,
+    InstrumentedRedis,
+    MetricsServer,
+    finish_update_tracking,
+    start_update_tracking,
+    start_metrics_logging,
+    track_handler,
+)
+from outbound import BotSender, OutboundQueue
+from order_queue import OrderJobQueue, OrderWorker
+from photo_cache import PhotoFileIdCache
+from prewarm import prewarm_caches
+from search_index import CatalogSearchIndex
+from session_store import SessionStore
+from strapi_client import (
+    ENDPOINT_TIMEOUT_FACTORS,
+    CircuitBreaker,
+    StrapiClient,
+    build_endpoint_timeouts,
+    get_endpoint_setting_name,
+)
+from update_recorder import UpdateRecorder
+from update_stream import UpdateStreamPublisher, UpdateStreamWorker
 
 logger = logging.getLogger(__name__)
 
+MENU_PAGE_PREFIX = 'menu_page_'
+CHECKOUT_PROMPT = (
+    "*Оформление заказа*\n\n"
+    "Для оформления заказа, пожалуйста, укажите ваш email:\n"
+    "(Пример: example@email.com)"
+)
+ORDER_ACCEPTED_MESSAGE = (
+    "⏳ Заказ принят и оформляется.\n"
+    "Пришлем подтверждение, как только он будет готов."
+)
+ORDER_IN_PROGRESS_MESSAGE = "⏳ Этот заказ уже оформляется, подтверждение придет в ближайшее время."
+ORDER_FAILED_MESSAGE = "❌ Не удалось оформить заказ. Корзина сохранена, попробуйте еще раз позже."
+BOT_ROLES = ('standalone', 'ingest', 'worker', 'order-worker')
+
 
 def create_redis_client():
     """Создает подключение к Redis"""
     database_password = env.str('DATABASE_PASSWORD', '')
     database_host = env.str('DATABASE_HOST', 'localhost')
     database_port = env.str('DATABASE_PORT', 6379)
-    return redis.Redis(
+    connection_pool = redis.BlockingConnectionPool(
         host=database_host,
         port=int(database_port),
         password=database_password,
-        decode_responses=True
+        decode_responses=True,
+        max_connections=env.int('DATABASE_MAX_CONNECTIONS', 50)
     )
+    return InstrumentedRedis(connection_pool=connection_pool)
 
 
-def create_handlers(strapi_url, strapi_token, redis_client):
-    """Создает все обработчики с замыканием зависимостей"""
-    def start(update, context):
-        fishes = product_service.get_fishes_from_strapi(strapi_url, strapi_token)
+def build_menu_keyboard(fishes, page=1, page_count=1):
+    """Строит клавиатуру меню по странице каталога с кнопками перехода между страницами"""
+    buttons = []
+    for fish in fishes:
+        fish_document_id = fish['documentId']
+        fish_title = fish['title']
+
+        button = InlineKeyboardButton(
+            fish_title,
+            callback_data=str(fish_document_id)
+        )
+        buttons.append([button])
+
+    navigation_buttons = []
+    if page > 1:
+        navigation_buttons.append(
+            InlineKeyboardButton('◀️ Предыдущие', callback_data=f'{MENU_PAGE_PREFIX}{page - 1}')
+        )
+    if page < page_count:
+        navigation_buttons.append(
+            InlineKeyboardButton('Следующие ▶️', callback_data=f'{MENU_PAGE_PREFIX}{page + 1}')
+        )
+    if navigation_buttons:
+        buttons.append(navigation_buttons)
+
+    buttons.append([InlineKeyboardButton('Моя Корзина', callback_data='view_cart')])
+
+    return InlineKeyboardMarkup(buttons)
+
+
+def build_search_view(search_query, products):
+    """Формирует текст и клавиатуру с результатами поиска по каталогу"""
+    if not products:
+        message = f"По запросу «{search_query}» ничего не найдено"
+    else:
+        message = f"Найдено по запросу «{search_query}»:"
+
+    buttons = [
+        [InlineKeyboardButton(f"{product['title']} - {product['price']} руб.",
+                              callback_data=str(product['documentId']))]
+        for product in products
+    ]
+    buttons.append([InlineKeyboardButton('Назад к выбору', callback_data='back_to_menu')])
+    return message, InlineKeyboardMarkup(buttons)
+
+
+def build_inline_results(products):
+    """Строит результаты inline-запроса: выбранный продукт отправляется в чат своим названием"""
+    return [
+        InlineQueryResultArticle(
+            id=str(product['documentId']),
+            title=product['title'],
+            description=f"{product['price']} руб. {product['description'][:100]}".strip(),
+            input_message_content=InputTextMessageContent(product['title'])
+        )
+        for product in products
+    ]
+
+
+def parse_menu_page(callback_data):
+    """Возвращает номер страницы каталога из кнопки навигации или None"""
+    if not callback_data.startswith(MENU_PAGE_PREFIX):
+        return None
+    try:
+        return max(int(callback_data[len(MENU_PAGE_PREFIX):]), 1)
+    except ValueError:
+        return None
+
+
+def get_view_fingerprint(text, reply_markup):
+    """Возвращает отпечатки текста и клавиатуры сообщения, чтобы сравнивать их без хранения текста"""
+    return {
+        'text': hashlib.sha1(text.encode('utf-8')).hexdigest()[:16],
+        'markup': hashlib.sha1(reply_markup.to_json().encode('utf-8')).hexdigest()[:16],
+    }
 
-        buttons = []
-        for fish in fishes:
-            fish_document_id = fish['documentId']
-            fish_title = fish['title']
 
-            button = InlineKeyboardButton(
-                fish_title,
-                callback_data=str(fish_document_id)
+def build_cart_view(cart_content):
+    """Формирует текст и клавиатуру корзины"""
+    if not cart_content['items']:
+        cart_message = "🛒 *Ваша корзина пуста*"
+        keyboard = [
+            [InlineKeyboardButton('Назад к выбору', callback_data='back_to_menu')]
+        ]
+    else:
+        lines = ["🛒 *Ваша корзина:*\n"]
+
+        for i, item in enumerate(cart_content['items'], 1):
+            lines.append(
+                f"{i}. *{item['title']}*\n"
+                f"   Количество: {item['quantity']} × {item['price']} руб. = {item['total']} руб."
             )
-            buttons.append([button])
-        buttons.append([InlineKeyboardButton('Моя Корзина', callback_data='view_cart')])
 
-        reply_markup = InlineKeyboardMarkup(buttons)
+        lines.append(f"\n*Итого:* {cart_content['total_sum']} руб.")
+        cart_message = "\n".join(lines)
+
+        keyboard = []
+        for item in cart_content['items']:
+            keyboard.append([
+                InlineKeyboardButton(
+                    f"❌ Удалить {item['title']}",
+                    callback_data=f"remove_{item['cart_product_id']}"
+                )
+            ])
+
+        keyboard.append([
+            InlineKeyboardButton('Очистить корзину', callback_data='clear_cart'),
+            InlineKeyboardButton('Оплатить', callback_data='pay')
+        ])
+        keyboard.append([
+            InlineKeyboardButton('Назад к выбору', callback_data='back_to_menu')
+        ])
+
+    return cart_message, InlineKeyboardMarkup(keyboard)
+
+
+def build_product_keyboard(fish_document_id):
+    """Строит клавиатуру карточки продукта"""
+    keyboard = [
+        [InlineKeyboardButton('Добавить в корзину', callback_data=f'buy_{fish_document_id}')],
+        [InlineKeyboardButton('Моя Корзина', callback_data='view_cart')],
+        [InlineKeyboardButton('Назад', callback_data='back_to_menu')]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
+def build_order_message(email, order, cart_content):
+    """Формирует сообщение об успешно оформленном заказе"""
+    items_list = ""
+    if cart_content['items']:
+        items_list = "\n".join([
+            f"   • {item['title']} - {item['quantity']} шт. × {item['price']} руб."
+            for item in cart_content['items']
+        ])
+        items_list = f"\n*Состав заказа:*\n{items_list}\n\n"
+
+    return (
+        "✅ *Заказ успешно оформлен!*\n\n"
+        f"Ваш email: `{email}`\n"
+        f"Номер заказа: `{order.get('documentId')}`\n"
+        f"Сумма заказа: *{cart_content['total_sum']} руб.*\n"
+        f"Товаров в заказе: *{len(cart_content['items'])}*\n"
+        f"{items_list}"
+        "Спасибо за покупку!"
+    )
+
+
+def parse_quantity(text):
+    """Разбирает количество товара из сообщения, возвращает None для некорректного ввода"""
+    try:
+        quantity = float(text.strip().replace(',', '.'))
+    except ValueError:
+        return None
+    if not math.isfinite(quantity) or quantity <= 0:
+        return None
+    return quantity
+
+
+def is_valid_email(email):
+    """Проверяет, похожа ли строка на email адрес"""
+    return '@' in email and '.' in email
+
+
+def create_handlers(strapi_client, redis_client, catalog_cache=None, product_cache=None,
+                    sessions=None, search_index=None, image_cache=None,
+                    outbound=None, order_queue=None):
+    """Создает все обработчики с замыканием зависимостей.
+
+    outbound - OutboundQueue для отправки сообщений вне потоков обработчиков,
+    без нее сообщения отправляются сразу через context.bot.
+    order_queue - OrderJobQueue: заказ ставится в очередь и оформляется
+    воркером заказов, без нее заказ оформляется прямо в обработчике.
+    """
+    if sessions is None:
+        sessions = SessionStore(redis_client)
+    if catalog_cache is None:
+        catalog_cache = CatalogCache(
+            lambda page: product_service.get_catalog_page(strapi_client, page)
+        )
+    if product_cache is None:
+        product_cache = ProductCache(
+            lambda document_id: product_service.get_product_details(strapi_client, document_id)
+        )
+    if search_index is None:
+        search_index = CatalogSearchIndex(
+            lambda: product_service.get_searchable_products(strapi_client)
+        )
+    photo_cache = PhotoFileIdCache(redis_client)
+    cart_ids = CartIdCache(
+        sessions,
+        lambda tg_id: product_service.get_or_create_cart(strapi_client, tg_id)
+    )
+    cart_projection = CartProjection(
+        redis_client,
+        lambda cart_document_id: product_service.get_cart_content_with_details(
+            strapi_client, cart_document_id
+        ),
+        ttl=sessions.ttl
+    )
+    menu_keyboards = OrderedDict()
+    menu_keyboards_lock = threading.Lock()
+    cleanup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cart-cleanup')
+
+    def get_menu_page(page):
+        catalog_version, catalog_page = catalog_cache.get(page)
+        if page > catalog_page['page_count']:
+            catalog_version, catalog_page = catalog_cache.get(catalog_page['page_count'])
+        return catalog_version, catalog_page
+
+    def get_menu_markup(context):
+        catalog_version, catalog_page = get_menu_page(context.user_data.get('menu_page', 1))
+        page = catalog_page['page']
+        context.user_data['menu_page'] = page
+
+        with menu_keyboards_lock:
+            keyboard_version, reply_markup = menu_keyboards.get(page, (None, None))
+            if keyboard_version == catalog_version:
+                menu_keyboards.move_to_end(page)
+                return reply_markup
+
+        reply_markup = build_menu_keyboard(
+            catalog_page['products'], page, catalog_page['page_count']
+        )
+        with menu_keyboards_lock:
+            menu_keyboards[page] = (catalog_version, reply_markup)
+            menu_keyboards.move_to_end(page)
+            while len(menu_keyboards) > catalog_cache.max_pages:
+                menu_keyboards.popitem(last=False)
+        return reply_markup
+
+    def with_cart(tg_id, action, stale_statuses=(404,)):
+        cart_document_id = cart_ids.get_or_create(tg_id)
+        try:
+            return action(cart_document_id)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in stale_statuses:
+                raise
+            logger.warning(f"Корзина {cart_document_id} пользователя {tg_id} не найдена в Strapi: {e}")
+            cart_ids.invalidate(tg_id)
+            cart_projection.invalidate(tg_id)
+            return action(cart_ids.get_or_create(tg_id))
+
+    def get_sender(context):
+        return outbound if outbound is not None else BotSender(context.bot)
+
+    def start(update, context):
+        reply_markup = get_menu_markup(context)
 
         if update.callback_query:
             query = update.callback_query
             query.answer()
-            query.message.reply_text('Выбери рыбку', reply_markup=reply_markup)
+            chat_id = query.message.chat_id
         else:
-            update.message.reply_text('Выбери рыбку', reply_markup=reply_markup)
+            chat_id = update.message.chat_id
+        get_sender(context).send_message(chat_id, 'Выбери рыбку', reply_markup=reply_markup)
         return "HANDLE_MENU"
 
-    def show_cart(update, context, edit=False):
+    def show_cart(update, context):
+        """Показывает корзину, по возможности не отправляя новое сообщение.
+
+        Отпечаток последней отрисованной корзины хранится в сессии вместе с
+        message_id. Если пользователь нажал кнопку в этом же сообщении,
+        оно правится на месте: без вызова Telegram, если ничего не
+        изменилось, и только клавиатура, если изменились лишь кнопки.
+        Другое текстовое сообщение заменяется корзиной, фото удаляется.
+        Отпечаток запоминается, когда отправка завершилась, а при ошибке
+        отправки забывается.
+        """
         query = update.callback_query
 
         if query:
             query.answer("Загружаем корзину...", show_alert=False)
 
-            if not edit:
-                try:
-                    context.bot.delete_message(
-                        chat_id=query.message.chat_id,
-                        message_id=query.message.message_id
-                    )
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить сообщение: {e}")
-
-        tg_id = str(query.message.chat_id) if query else str(update.message.chat_id)
-
-        cart_document_id = product_service.get_or_create_cart(strapi_url, strapi_token, tg_id)
+        chat_id = query.message.chat_id if query else update.message.chat_id
+        tg_id = str(chat_id)
 
         try:
-            cart_content = product_service.get_cart_content_with_details(
-                strapi_url, strapi_token, cart_document_id
+            cart_content = with_cart(
+                tg_id, lambda cart_document_id: cart_projection.get(tg_id, cart_document_id)
             )
         except Exception as e:
             logger.error(f"Ошибка получения корзины: {e}")
             cart_content = {'items': [], 'total_sum': 0}
 
-        if not cart_content['items']:
-            cart_message = "🛒 *Ваша корзина пуста*"
-            keyboard = [
-                [InlineKeyboardButton('Назад к выбору', callback_data='back_to_menu')]
-            ]
-        else:
-            lines = ["🛒 *Ваша корзина:*\n"]
-
-            for i, item in enumerate(cart_content['items'], 1):
-                lines.append(
-                    f"{i}. *{item['title']}*\n"
-                    f"   Количество: {item['quantity']} × {item['price']} руб. = {item['total']} руб."
+        cart_message, reply_markup = build_cart_view(cart_content)
+        fingerprint = get_view_fingerprint(cart_message, reply_markup)
+        rendered = sessions.get_cart_message(chat_id) or {}
+        sender = get_sender(context)
+        message_id = None
+
+        if query and rendered.get('message_id') == query.message.message_id:
+            message_id = query.message.message_id
+            if rendered['text'] != fingerprint['text']:
+                future = sender.edit_message_text(
+                    chat_id, message_id, cart_message,
+                    reply_markup=reply_markup, parse_mode="Markdown"
                 )
+            elif rendered['markup'] != fingerprint['markup']:
+                future = sender.edit_message_reply_markup(chat_id, message_id, reply_markup)
+            else:
+                OUTBOUND_OPERATIONS.inc(method='edit_message_text', result='unchanged')
+                return "HANDLE_CART"
+        elif query and not query.message.photo:
+            message_id = query.message.message_id
+            future = sender.replace_message(
+                chat_id, message_id, cart_message,
+                reply_markup=reply_markup, parse_mode="Markdown"
+            )
+        else:
+            if query:
+                sender.delete_message(chat_id, query.message.message_id)
+            future = sender.send_message(
+                chat_id, cart_message, reply_markup=reply_markup, parse_mode="Markdown"
+            )
 
-            lines.append(f"\n*Итого:* {cart_content['total_sum']} руб.")
-            cart_message = "\n".join(lines)
+        def remember_cart_message(future):
+            if future.exception() is not None:
+                sessions.save_cart_message(chat_id, None)
+                return
+            # replace_message мог отправить новое сообщение вместо правки
+            sent_message_id = getattr(future.result(), 'message_id', None) or message_id
+            sessions.save_cart_message(chat_id, {'message_id': sent_message_id, **fingerprint})
 
-            keyboard = []
-            for item in cart_content['items']:
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"❌ Удалить {item['title']}",
-                        callback_data=f"remove_{item['cart_product_id']}"
-                    )
-                ])
+        future.add_done_callback(remember_cart_message)
+        return "HANDLE_CART"
 
-            keyboard.append([
-                InlineKeyboardButton('Очистить корзину', callback_data='clear_cart'),
-                InlineKeyboardButton('Оплатить', callback_data='pay')
-            ])
-            keyboard.append([
-                InlineKeyboardButton('Назад к выбору', callback_data='back_to_menu')
-            ])
+    def send_product_photo(bot, chat_id, product, caption, reply_markup):
+        document_id = product['document_id']
+        picture_version = product['picture_version']
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        file_id = photo_cache.get(document_id, picture_version)
+        if file_id:
+            try:
+                return bot.send_photo(
+                    chat_id=chat_id,
+                    photo=file_id,
+                    caption=caption,
+                    reply_markup=reply_markup
+                )
+            except BadRequest as e:
+                logger.warning(f"Telegram отклонил сохраненный file_id: {e}")
+                photo_cache.invalidate(document_id)
 
-        if query and edit:
-            query.edit_message_text(
-                text=cart_message,
-                reply_markup=reply_markup,
-                parse_mode="Markdown"
-            )
+        if image_cache is not None:
+            image_bytes = image_cache.get(product['picture_urls'][0])
         else:
-            context.bot.send_message(
-                chat_id=query.message.chat_id if query else update.message.chat_id,
-                text=cart_message,
-                reply_markup=reply_markup,
-                parse_mode="Markdown"
-            )
-        return "HANDLE_CART"
+            image_bytes = product_service.get_picture_bytes(strapi_client, product)
+        image_file = BytesIO(image_bytes)
+        image_file.name = f'product_image_{document_id}.jpg'
+
+        message = bot.send_photo(
+            chat_id=chat_id,
+            photo=image_file,
+            caption=caption,
+            reply_markup=reply_markup
+        )
+        if message.photo:
+            photo_cache.set(document_id, picture_version, message.photo[-1].file_id)
+        return message
+
+    def show_menu_page(update, context, page):
+        context.user_data['menu_page'] = page
+        message = update.callback_query.message
+        get_sender(context).edit_message_reply_markup(
+            message.chat_id, message.message_id, get_menu_markup(context)
+        )
+        return "HANDLE_MENU"
+
+    def search_products(update, context):
+        search_query = update.message.text.strip()
+        products = search_index.search(search_query)
+        message, reply_markup = build_search_view(search_query, products)
+        get_sender(context).send_message(update.message.chat_id, message, reply_markup=reply_markup)
+        return "HANDLE_MENU"
+
+    def answer_inline_query(update, context):
+        products = search_index.search(update.inline_query.query)
+        update.inline_query.answer(build_inline_results(products), cache_time=60)
 
     def show_product_description(update, context):
+        if update.message:
+            return search_products(update, context)
+
         query = update.callback_query
         query.answer()
 
         if query.data == 'view_cart':
             return show_cart(update, context)
 
-        try:
-            context.bot.delete_message(
-                chat_id=query.message.chat_id,
-                message_id=query.message.message_id
-            )
-        except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение: {e}")
+        menu_page = parse_menu_page(query.data)
+        if menu_page is not None:
+            return show_menu_page(update, context, menu_page)
 
-        fish_document_id = query.data
-        fish_description = product_service.get_description_from_strapi(
-            strapi_url, strapi_token, fish_document_id
-        )
+        sender = get_sender(context)
+        sender.delete_message(query.message.chat_id, query.message.message_id)
 
-        image_bytes = product_service.get_picture_bytes_from_strapi(
-            strapi_url, strapi_token, fish_document_id
-        )
+        fish_document_id = query.data
+        product = product_cache.get(fish_document_id)
+        fish_description = product_service.format_product_description(product)
 
         context.user_data['current_product'] = fish_document_id
 
-        keyboard = [
-            [InlineKeyboardButton('Добавить в корзину', callback_data=f'buy_{fish_document_id}')],
-            [InlineKeyboardButton('Моя Корзина', callback_data='view_cart')],
-            [InlineKeyboardButton('Назад', callback_data='back_to_menu')]
-        ]
+        reply_markup = build_product_keyboard(fish_document_id)
+
+        if product['picture_urls']:
+            sender.call(
+                query.message.chat_id, send_product_photo,
+                query.message.chat_id, product, fish_description, reply_markup
+            )
+        else:
+            sender.send_message(query.message.chat_id, fish_description, reply_markup=reply_markup)
+        return "HANDLE_DESCRIPTION"
+
+    def add_to_cart(tg_id, product_document_id, quantity):
+        # Привязку к несуществующей корзине Strapi отклоняет с кодом 400
+        cart_product = with_cart(
+            tg_id,
+            lambda cart_document_id: product_service.add_cart_product(
+                strapi_client, cart_document_id, product_document_id, quantity
+            ),
+            stale_statuses=(400, 404)
+        )
+        product = product_cache.get(product_document_id)
+        cart_projection.add_line(
+            tg_id, cart_product['documentId'],
+            product['title'], product['price'], cart_product['quantity']
+        )
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    def handle_quantity_input(update, context):
+        product_document_id = context.user_data.get('current_product')
+        quantity = parse_quantity(update.message.text)
 
-        if image_bytes:
-            image_file = BytesIO(image_bytes)
-            image_file.name = f'product_image_{fish_document_id}.jpg'
+        chat_id = update.message.chat_id
 
-            context.bot.send_photo(
-                chat_id=query.message.chat_id,
-                photo=image_file,
-                caption=fish_description,
-                reply_markup=reply_markup
+        if not product_document_id or quantity is None:
+            get_sender(context).send_message(
+                chat_id, "Отправьте количество числом, например: 2 или 1.5"
             )
-        else:
-            query.message.reply_text(fish_description, reply_markup=reply_markup)
+            return "HANDLE_DESCRIPTION"
+
+        add_to_cart(str(chat_id), product_document_id, quantity)
+        get_sender(context).send_message(chat_id, f"✅ Добавлено в корзину: {quantity:g}")
         return "HANDLE_DESCRIPTION"
 
     def handle_description(update, context):
+        if update.message:
+            return handle_quantity_input(update, context)
+
         query = update.callback_query
         button_callback = query.data
 
         if button_callback == 'back_to_menu':
-            try:
-                context.bot.delete_message(
-                    chat_id=query.message.chat_id,
-                    message_id=query.message.message_id
-                )
-            except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение: {e}")
+            get_sender(context).delete_message(query.message.chat_id, query.message.message_id)
             return start(update, context)
 
         elif button_callback.startswith('buy_'):
             product_document_id = button_callback.split('_')[1]
-            tg_id = str(query.message.chat_id)
-
-            cart_document_id = product_service.get_or_create_cart(
-                strapi_url, strapi_token, tg_id
-            )
-            product_service.add_cart_product(
-                strapi_url, strapi_token, 
-                cart_document_id, product_document_id, 1.0
+            add_to_cart(str(query.message.chat_id), product_document_id, 1.0)
+            query.answer(
+                "Товар добавлен в корзину! Чтобы добавить другое количество, "
+                "отправьте его сообщением",
+                show_alert=False
             )
-            query.answer("Товар добавлен в корзину!", show_alert=False)
             return "HANDLE_DESCRIPTION"
         elif button_callback == 'view_cart':
             return show_cart(update, context)
@@ -215,13 +552,7 @@ def create_handlers(strapi_url, strapi_token, redis_client):
         button_callback = query.data
 
         if button_callback == 'back_to_menu':
-            try:
-                context.bot.delete_message(
-                    chat_id=query.message.chat_id,
-                    message_id=query.message.message_id
-                )
-            except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение: {e}")
+            get_sender(context).delete_message(query.message.chat_id, query.message.message_id)
             return start(update, context)
 
         elif button_callback.startswith('remove_'):
@@ -229,118 +560,136 @@ def create_handlers(strapi_url, strapi_token, redis_client):
 
             try:
                 product_service.delete_cart_product(
-                    strapi_url, strapi_token, cart_product_id
+                    strapi_client, cart_product_id
                 )
+                cart_projection.remove_line(str(query.message.chat_id), cart_product_id)
                 query.answer("✅ Товар удален из корзины", show_alert=False)
             except Exception as e:
                 logger.error(f"Ошибка удаления товара: {e}")
                 query.answer("Ошибка удаления товара", show_alert=True)
                 return "HANDLE_CART"
-            return show_cart(update, context, edit=True)
+            return show_cart(update, context)
 
         elif button_callback == 'clear_cart':
             tg_id = str(query.message.chat_id)
 
             try:
-                product_service.clear_cart(strapi_url, strapi_token, tg_id)
-                query.answer("✅ Корзина очищена", show_alert=False)
+                is_cleared = product_service.clear_cart(strapi_client, tg_id)
             except Exception as e:
                 logger.error(f"Ошибка очистки корзины: {e}")
+                is_cleared = False
+
+            if not is_cleared:
+                cart_projection.invalidate(tg_id)
                 query.answer("❌ Ошибка очистки корзины", show_alert=True)
                 return "HANDLE_CART"
-            return show_cart(update, context, edit=False)
+
+            cart_projection.clear(tg_id)
+            query.answer("✅ Корзина очищена", show_alert=False)
+            return show_cart(update, context)
 
         elif button_callback == 'pay':
             query.answer("Переходим к оплате...", show_alert=False)
-
-            try:
-                context.bot.delete_message(
-                    chat_id=query.message.chat_id,
-                    message_id=query.message.message_id
-                )
-            except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение: {e}")
-
-            context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text="*Оформление заказа*\n\n"
-                     "Для оформления заказа, пожалуйста, укажите ваш email:\n"
-                     "(Пример: example@email.com)",
-                parse_mode="Markdown"
-            )
+            chat_id = query.message.chat_id
+            # Отпечаток забывается после замены корзины, чтобы его не
+            # перезаписала еще не отправленная отрисовка корзины
+            get_sender(context).replace_message(
+                chat_id, query.message.message_id, CHECKOUT_PROMPT, parse_mode="Markdown"
+            ).add_done_callback(lambda future: sessions.save_cart_message(chat_id, None))
             return "WAITING_EMAIL"
 
         query.answer()
         return "HANDLE_CART"
 
+    def cleanup_ordered_cart(tg_id, cart_product_ids):
+        try:
+            failed_ids = product_service.delete_cart_products(strapi_client, cart_product_ids)
+        except Exception:
+            logger.exception(f"Ошибка очистки корзины {tg_id} после заказа")
+            failed_ids = cart_product_ids
+
+        for cart_product_id in failed_ids:
+            logger.error(f"Не удалось удалить позицию {cart_product_id} корзины {tg_id} после заказа")
+        if failed_ids:
+            cart_projection.invalidate(tg_id)
+
+    def enqueue_order(update, context, tg_id, email):
+        chat_id = update.message.chat_id
+        try:
+            job_id, is_new = order_queue.enqueue(
+                chat_id, tg_id, cart_ids.get_or_create(tg_id), email
+            )
+        except Exception as e:
+            logger.error(f"Не удалось поставить заказ в очередь: {e}", exc_info=True)
+            get_sender(context).send_message(chat_id, ORDER_FAILED_MESSAGE)
+            return start(update, context)
+
+        logger.info(f"Заказ поставлен в очередь: {job_id}")
+        get_sender(context).send_message(
+            chat_id, ORDER_ACCEPTED_MESSAGE if is_new else ORDER_IN_PROGRESS_MESSAGE
+        )
+        return start(update, context)
+
     def waiting_for_email(update, context):
         if update.message:
             email = update.message.text.strip()
 
-            if '@' not in email or '.' not in email:
-                update.message.reply_text(
+            chat_id = update.message.chat_id
+            sender = get_sender(context)
+
+            if not is_valid_email(email):
+                sender.send_message(
+                    chat_id,
                     "❌ Пожалуйста, введите корректный email адрес.\n"
                     "Пример: example@email.com"
                 )
                 return "WAITING_EMAIL"
 
-            tg_id = str(update.message.chat_id)
+            tg_id = str(chat_id)
+            if order_queue is not None:
+                return enqueue_order(update, context, tg_id, email)
+
             try:
-                cart_document_id = product_service.get_or_create_cart(
-                    strapi_url, strapi_token, tg_id
+                cart_document_id, cart_content = with_cart(
+                    tg_id,
+                    lambda cart_document_id: (
+                        cart_document_id,
+                        product_service.get_cart_content_with_details(strapi_client, cart_document_id)
+                    )
                 )
                 logger.info(f"Cart document ID: {cart_document_id}")
-
-                cart_content = product_service.get_cart_content_with_details(
-                    strapi_url, strapi_token, cart_document_id
-                )
                 logger.info(f"Cart content: {cart_content}")
 
                 order = product_service.create_order(
-                    strapi_url, strapi_token, cart_document_id, email
+                    strapi_client, cart_document_id, email
                 )
                 logger.info(f"Order created: {order}")
 
-                items_list = ""
-                if cart_content['items']:
-                    items_list = "\n".join([
-                        f"   • {item['title']} - {item['quantity']} шт. × {item['price']} руб."
-                        for item in cart_content['items']
-                    ])
-                    items_list = f"\n*Состав заказа:*\n{items_list}\n\n"
-
-                success_message = (
-                    "✅ *Заказ успешно оформлен!*\n\n"
-                    f"Ваш email: `{email}`\n"
-                    f"Номер заказа: `{order.get('documentId')}`\n"
-                    f"Сумма заказа: *{cart_content['total_sum']} руб.*\n"
-                    f"Товаров в заказе: *{len(cart_content['items'])}*\n"
-                    f"{items_list}"
-                    "Спасибо за покупку!"
-                )
+                success_message = build_order_message(email, order, cart_content)
 
-                for item in cart_content['items']:
-                    product_service.delete_cart_product(
-                        strapi_url, strapi_token, item['cart_product_id']
-                    )
+                sender.send_message(chat_id, success_message, parse_mode="Markdown")
 
-                update.message.reply_text(
-                    success_message,
-                    parse_mode="Markdown"
+                cart_projection.clear(tg_id)
+                cleanup_executor.submit(
+                    cleanup_ordered_cart,
+                    tg_id,
+                    [item['cart_product_id'] for item in cart_content['items']]
                 )
                 return start(update, context)
 
             except Exception as e:
                 logger.error(f"Ошибка при оформлении заказа: {e}", exc_info=True)
-                update.message.reply_text(
-                    f"❌ Произошла ошибка при оформлении заказа: {str(e)}"
+                sender.send_message(
+                    chat_id, f"❌ Произошла ошибка при оформлении заказа: {str(e)}"
                 )
                 return start(update, context)
         elif update.callback_query:
             query = update.callback_query
             query.answer()
-            query.edit_message_text(
-                text="❌ Оформление заказа отменено.",
+            get_sender(context).edit_message_text(
+                query.message.chat_id,
+                query.message.message_id,
+                "❌ Оформление заказа отменено.",
                 reply_markup=InlineKeyboardMarkup([
                     [InlineKeyboardButton('Вернуться в меню', callback_data='back_to_menu')]
                 ])
@@ -349,36 +698,44 @@ def create_handlers(strapi_url, strapi_token, redis_client):
         return "WAITING_EMAIL"
 
     def handle_users_reply(update, context):
+        start_update_tracking()
+        try:
+            process_update(update, context)
+        finally:
+            finish_update_tracking()
+
+    def process_update(update, context):
+        if update.inline_query:
+            with track_handler('answer_inline_query'):
+                answer_inline_query(update, context)
+            return
+
         if update.message:
             user_reply = update.message.text
             chat_id = update.message.chat_id
         elif update.callback_query:
             user_reply = update.callback_query.data
             chat_id = update.callback_query.message.chat_id
+        else:
+            return
 
-            if user_reply == "back_to_menu":
-                context.bot.delete_message(
-                    chat_id=chat_id,
-                    message_id=update.callback_query.message.message_id
-                )
+        session = sessions.load(chat_id)
+        context.user_data.clear()
+        context.user_data.update(session['user_data'])
+        if session['cart_id']:
+            cart_ids.remember(chat_id, session['cart_id'])
+
+        if update.callback_query and user_reply == "back_to_menu":
+            get_sender(context).delete_message(chat_id, update.callback_query.message.message_id)
+            with track_handler('start'):
                 next_state = start(update, context)
-                redis_client.set(chat_id, next_state)
-                return
-        else:
+            sessions.save(chat_id, next_state, context.user_data, cart_ids.peek(chat_id))
             return
 
         if user_reply == '/start':
             user_state = 'START'
         else:
-            user_state = redis_client.get(chat_id)
-            if user_state is None:
-                user_state = 'START'
-            else:
-                try:
-                    if isinstance(user_state, bytes):
-                        user_state = user_state.decode('utf-8')
-                except (AttributeError, UnicodeDecodeError):
-                    user_state = 'START'
+            user_state = session['state'] or 'START'
 
         states_functions = {
             'START': start,
@@ -391,14 +748,104 @@ def create_handlers(strapi_url, strapi_token, redis_client):
         state_handler = states_functions.get(user_state, start)
 
         try:
-            next_state = state_handler(update, context)
-            redis_client.set(chat_id, next_state)
+            with track_handler(state_handler.__name__):
+                next_state = state_handler(update, context)
+            sessions.save(chat_id, next_state, context.user_data, cart_ids.peek(chat_id))
         except Exception as err:
             logger.error(f'Ошибка установки статуса в БД {err}')
 
     return handle_users_reply
 
 
+def run_webhook(updater):
+    """Принимает обновления через локальный webhook-эндпоинт вместо polling"""
+    webhook_secret = env.str('WEBHOOK_SECRET', None)
+    webhook_server = WebhookServer(
+        updater.bot,
+        updater.dispatcher.update_queue,
+        listen=env.str('WEBHOOK_LISTEN', '127.0.0.1'),
+        port=env.int('WEBHOOK_PORT', 8443),
+        url_path=env.str('WEBHOOK_PATH', 'telegram'),
+        secret_token=webhook_secret
+    )
+
+    webhook_url = env.str('WEBHOOK_URL', None)
+    if webhook_url:
+        updater.bot.set_webhook(url=webhook_url, secret_token=webhook_secret)
+
+    dispatcher_thread = threading.Thread(
+        target=updater.dispatcher.start, name='dispatcher', daemon=True
+    )
+    dispatcher_thread.start()
+
+    logger.info(f'Webhook слушает порт {webhook_server.port}')
+    try:
+        webhook_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        webhook_server.close()
+        updater.dispatcher.stop()
+
+
+def create_order_worker(redis_client, strapi_client, order_queue, sender, max_workers=4,
+                        cart_ttl=7 * 24 * 3600):
+    """Создает воркер заказов, который сообщает пользователю результат через sender"""
+    def on_done(job, order, cart_content):
+        sender.send_message(
+            job['chat_id'],
+            build_order_message(job['email'], order, cart_content),
+            parse_mode="Markdown"
+        )
+
+    def on_failed(job, error):
+        sender.send_message(job['chat_id'], ORDER_FAILED_MESSAGE)
+
+    cart_projection = CartProjection(
+        redis_client,
+        lambda cart_document_id: product_service.get_cart_content_with_details(
+            strapi_client, cart_document_id
+        ),
+        ttl=cart_ttl
+    )
+    return OrderWorker(
+        redis_client, strapi_client, order_queue, on_done, on_failed,
+        cart_projection=cart_projection, max_workers=max_workers
+    )
+
+
+def run_order_worker(worker):
+    """Запускает воркер заказов и останавливает его по Ctrl+C"""
+    logger.info(f'Воркер заказов читает {worker.stream} как {worker.consumer_name}')
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+        worker.close()
+
+
+def run_stream_worker(worker):
+    """Запускает воркер шарда и останавливает его по Ctrl+C.
+
+    Диспетчер PTB запускается и здесь: обновления он не получает, но без
+    него не работают его пулы потоков (run_async, job queue), которые
+    доступны обработчикам через context.
+    """
+    dispatcher_thread = threading.Thread(
+        target=worker.dispatcher.start, name='dispatcher', daemon=True
+    )
+    dispatcher_thread.start()
+
+    logger.info(f'Воркер читает {worker.stream} как {worker.consumer_name}')
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+        worker.close()
+    finally:
+        worker.dispatcher.stop()
+
+
 def main():
     logging.basicConfig(
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
@@ -411,21 +858,177 @@ def main():
     strapi_url = env.str('STRAPI_URL', 'http://localhost:1337')
     strapi_token = env.str('STRAPI_TOKEN')
 
+    bot_role = env.str('BOT_ROLE', 'standalone', validate=validate.OneOf(BOT_ROLES))
+    # Процессу order-worker без потоков нечего делать, поэтому 0 для него - ошибка конфигурации
+    order_workers = env.int(
+        'ORDER_WORKERS', 4, validate=validate.Range(min=1 if bot_role == 'order-worker' else 0)
+    )
+
     logger.info('Бот запущен')
 
+    metrics_port = env.int('METRICS_PORT', 0)
+    if metrics_port:
+        MetricsServer(listen=env.str('METRICS_LISTEN', '127.0.0.1'), port=metrics_port).start()
+
+    metrics_log_interval = env.int('METRICS_LOG_INTERVAL', 0)
+    if metrics_log_interval:
+        start_metrics_logging(metrics_log_interval)
+
     updater = Updater(tg_bot_token)
 
     redis_client = create_redis_client()
+    sessions = SessionStore(redis_client, ttl=env.int('SESSION_TTL', 7 * 24 * 3600))
+
+    circuit_breaker = CircuitBreaker(
+        failure_threshold=env.int('STRAPI_BREAKER_THRESHOLD', 5),
+        recovery_timeout=env.float('STRAPI_BREAKER_RECOVERY', 30)
+    )
+
+    strapi_timeout = env.float('STRAPI_TIMEOUT', 10)
+    strapi_client = StrapiClient(
+        strapi_url,
+        strapi_token,
+        pool_size=env.int('STRAPI_POOL_SIZE', 10),
+        timeout=strapi_timeout,
+        endpoint_timeouts=build_endpoint_timeouts(strapi_timeout, {
+            prefix: env.float(f'STRAPI_TIMEOUT_{get_endpoint_setting_name(prefix)}', None)
+            for prefix in ENDPOINT_TIMEOUT_FACTORS
+        }),
+        retries=env.int('STRAPI_RETRIES', 3),
+        circuit_breaker=circuit_breaker
+    )
 
-    main_handler = create_handlers(strapi_url, strapi_token, redis_client)
+    catalog_page_size = env.int('CATALOG_PAGE_SIZE', product_service.CATALOG_PAGE_SIZE)
+    catalog_cache = CatalogCache(
+        lambda page: product_service.get_catalog_page(strapi_client, page, catalog_page_size),
+        ttl=env.int('CATALOG_CACHE_TTL', 300),
+        redis_client=redis_client if env.bool('CATALOG_CACHE_SHARED', False) else None
+    )
+
+    product_cache = ProductCache(
+        lambda document_id: product_service.get_product_details(strapi_client, document_id),
+        max_size=env.int('PRODUCT_CACHE_SIZE', 256),
+        ttl=env.int('PRODUCT_CACHE_TTL', 300)
+    )
+
+    image_cache = None
+    image_cache_dir = env.str('IMAGE_CACHE_DIR', 'image_cache')
+    if image_cache_dir:
+        image_cache = ImageCache(
+            strapi_client,
+            image_cache_dir,
+            max_bytes=env.int('IMAGE_CACHE_MAX_MB', 200) * 1024 * 1024,
+            max_side=env.int('IMAGE_MAX_SIDE', 1280)
+        )
+
+    search_index = CatalogSearchIndex(
+        lambda: product_service.get_searchable_products(strapi_client),
+        ttl=env.int('SEARCH_INDEX_TTL', 300)
+    )
+
+    if bot_role in ('standalone', 'worker') and env.bool('CATALOG_EVENTS', False):
+        CatalogInvalidator(redis_client, catalog_cache, product_cache, search_index).start()
+
+    strapi_webhook_port = env.int('STRAPI_WEBHOOK_PORT', 0)
+    if strapi_webhook_port:
+        StrapiWebhookServer(
+            redis_client,
+            listen=env.str('STRAPI_WEBHOOK_LISTEN', '127.0.0.1'),
+            port=strapi_webhook_port,
+            secret=env.str('STRAPI_WEBHOOK_SECRET', None)
+        ).start()
+
+    outbound = None
+    outbound_workers = env.int('OUTBOUND_WORKERS', 8)
+    if outbound_workers:
+        outbound = OutboundQueue(
+            updater.bot,
+            global_rate=env.float('TELEGRAM_GLOBAL_RATE', 30),
+            chat_rate=env.float('TELEGRAM_CHAT_RATE', 1),
+            chat_burst=env.int('TELEGRAM_CHAT_BURST', 3),
+            max_workers=outbound_workers
+        )
+
+    order_queue = None
+    if env.bool('ORDER_QUEUE', False) or bot_role == 'order-worker':
+        order_queue = OrderJobQueue(redis_client)
+
+    if order_queue is not None and order_workers and bot_role != 'ingest':
+        order_worker = create_order_worker(
+            redis_client, strapi_client, order_queue,
+            outbound if outbound is not None else BotSender(updater.bot),
+            max_workers=order_workers,
+            cart_ttl=sessions.ttl
+        )
+        if bot_role == 'order-worker':
+            run_order_worker(order_worker)
+            if outbound is not None:
+                outbound.close()
+            return
+        threading.Thread(target=order_worker.run, name='order-worker', daemon=True).start()
 
     dispatcher = updater.dispatcher
+    stream_shards = env.int('STREAM_SHARDS', 1)
+
+    if bot_role != 'ingest' and env.bool('PREWARM', False):
+        prewarm_caches(
+            catalog_cache,
+            product_cache,
+            image_cache=image_cache,
+            photo_cache=PhotoFileIdCache(redis_client),
+            search_index=search_index,
+            max_workers=env.int('PREWARM_WORKERS', 8),
+            time_budget=env.float('PREWARM_TIMEOUT', 30)
+        )
+
+    if bot_role == 'worker':
+        run_stream_worker(
+            UpdateStreamWorker(
+                redis_client,
+                dispatcher,
+                create_handlers(
+                    strapi_client, redis_client, catalog_cache, product_cache, sessions,
+                    search_index, image_cache, outbound, order_queue
+                ),
+                shard=env.int('WORKER_SHARD', 0),
+                max_workers=env.int('DISPATCH_WORKERS', 16)
+            )
+        )
+        if outbound is not None:
+            outbound.close()
+        return
+
+    if bot_role == 'ingest':
+        main_handler = UpdateStreamPublisher(redis_client, stream_shards).handle_update
+    else:
+        main_handler = create_ordered_handler(
+            ChatOrderedExecutor(max_workers=env.int('DISPATCH_WORKERS', 16)),
+            create_handlers(
+                strapi_client, redis_client, catalog_cache, product_cache, sessions,
+                search_index, image_cache, outbound, order_queue
+            )
+        )
+
+    # Обновления записываются при приеме, в потоке диспетчера, до очередей
+    # чатов и Redis streams, чтобы время в логе не включало ожидание в них
+    record_updates_path = env.str('RECORD_UPDATES_PATH', None)
+    if record_updates_path:
+        recorder = UpdateRecorder(record_updates_path, salt=env.str('RECORD_SALT', None))
+        dispatcher.add_handler(TypeHandler(Update, recorder.handle_update), group=-1)
+
     dispatcher.add_handler(CallbackQueryHandler(main_handler))
     dispatcher.add_handler(MessageHandler(Filters.text, main_handler))
     dispatcher.add_handler(CommandHandler('start', main_handler))
+    dispatcher.add_handler(InlineQueryHandler(main_handler))
+
+    if env.str('BOT_MODE', 'polling') == 'webhook':
+        run_webhook(updater)
+    else:
+        updater.start_polling()
+        updater.idle()
 
-    updater.start_polling()
-    updater.idle()
+    if outbound is not None:
+        outbound.close()
 
 
 if __name__ == '__main__':
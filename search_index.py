@@ -0,0 +1,183 @@
+import bisect
+import difflib
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+TITLE_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+PREFIX_PENALTY = 0.7
+FUZZY_PENALTY = 0.5
+
+
+def tokenize(text):
+    """Разбивает текст на слова в нижнем регистре"""
+    return TOKEN_PATTERN.findall(str(text or '').lower().replace('ё', 'е'))
+
+
+class CatalogSearchIndex:
+    """Поисковый индекс каталога в памяти процесса.
+
+    Индексирует название, описание и цену всех продуктов и ищет по
+    точному совпадению слов, по префиксу и с опечатками (difflib), поэтому
+    поиск не обращается к Strapi. Каталог перезагружается раз в ttl секунд
+    в фоне, а индекс перестраивается инкрементально: заново разбираются
+    только продукты, содержимое которых изменилось.
+    """
+
+    def __init__(self, loader, ttl=300, fuzzy_cutoff=0.75):
+        self.loader = loader
+        self.ttl = ttl
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._lock = threading.Lock()
+        self._products = {}
+        self._fingerprints = {}
+        self._postings = {}
+        self._sorted_tokens = []
+        self._expires_at = 0
+        self._is_loaded = False
+        self._is_refreshing = False
+
+    def search(self, query, limit=10):
+        """Возвращает до limit продуктов, подходящих под запрос, лучшие первыми"""
+        self._ensure_fresh()
+
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            scores = None
+            for term in terms:
+                term_scores = self._match_term(term)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        document_id: score + term_scores[document_id]
+                        for document_id, score in scores.items()
+                        if document_id in term_scores
+                    }
+                if not scores:
+                    return []
+
+            ranked_ids = sorted(
+                scores,
+                key=lambda document_id: (-scores[document_id], self._products[document_id]['title'])
+            )
+            return [self._products[document_id] for document_id in ranked_ids[:limit]]
+
+    def update(self, products):
+        """Применяет к индексу новый список продуктов: добавляет, обновляет и удаляет записи"""
+        with self._lock:
+            fresh_ids = set()
+            for product in products:
+                document_id = product['documentId']
+                fresh_ids.add(document_id)
+                fingerprint = self._make_fingerprint(product)
+                if self._fingerprints.get(document_id) == fingerprint:
+                    continue
+                self._remove(document_id)
+                self._add(document_id, product, fingerprint)
+
+            for document_id in set(self._products) - fresh_ids:
+                self._remove(document_id)
+
+            self._sorted_tokens = sorted(self._postings)
+            self._expires_at = time.monotonic() + self.ttl
+            self._is_loaded = True
+
+    def invalidate(self):
+        """Помечает индекс устаревшим, следующий поиск запустит обновление"""
+        with self._lock:
+            self._expires_at = 0
+
+    def _ensure_fresh(self):
+        with self._lock:
+            if time.monotonic() < self._expires_at:
+                return
+            if self._is_loaded:
+                if not self._is_refreshing:
+                    self._is_refreshing = True
+                    threading.Thread(target=self._refresh, daemon=True).start()
+                return
+
+        self.update(self.loader())
+
+    def _refresh(self):
+        try:
+            self.update(self.loader())
+        except Exception as e:
+            logger.warning(f"Не удалось обновить поисковый индекс, ищем по старому: {e}")
+        finally:
+            with self._lock:
+                self._is_refreshing = False
+
+    def _add(self, document_id, product, fingerprint):
+        self._products[document_id] = {
+            'documentId': document_id,
+            'title': product.get('title', 'Без названия'),
+            'price': product.get('price', 0),
+            'description': product.get('description') or '',
+        }
+        self._fingerprints[document_id] = fingerprint
+
+        fields = (
+            (product.get('title'), TITLE_WEIGHT),
+            (product.get('description'), DESCRIPTION_WEIGHT),
+            (product.get('price'), DESCRIPTION_WEIGHT),
+        )
+        for text, weight in fields:
+            for token in tokenize(text):
+                token_postings = self._postings.setdefault(token, {})
+                token_postings[document_id] = max(token_postings.get(document_id, 0), weight)
+
+    def _remove(self, document_id):
+        if document_id not in self._products:
+            return
+        product = self._products.pop(document_id)
+        del self._fingerprints[document_id]
+
+        for text in (product['title'], product['description'], product['price']):
+            for token in tokenize(text):
+                token_postings = self._postings.get(token)
+                if token_postings is None:
+                    continue
+                token_postings.pop(document_id, None)
+                if not token_postings:
+                    del self._postings[token]
+
+    def _match_term(self, term):
+        scores = dict(self._postings.get(term, {}))
+
+        position = bisect.bisect_left(self._sorted_tokens, term)
+        while position < len(self._sorted_tokens) and self._sorted_tokens[position].startswith(term):
+            token = self._sorted_tokens[position]
+            position += 1
+            if token == term:
+                continue
+            for document_id, weight in self._postings[token].items():
+                scores[document_id] = max(scores.get(document_id, 0), weight * PREFIX_PENALTY)
+
+        if scores or len(term) < 3:
+            return scores
+
+        for token in difflib.get_close_matches(term, self._sorted_tokens, n=5, cutoff=self.fuzzy_cutoff):
+            for document_id, weight in self._postings[token].items():
+                scores[document_id] = max(scores.get(document_id, 0), weight * FUZZY_PENALTY)
+        return scores
+
+    @staticmethod
+    def _make_fingerprint(product):
+        serialized = json.dumps(
+            [product.get('title'), product.get('description'), product.get('price')],
+            sort_keys=True
+        ).encode('utf-8')
+        return hashlib.sha1(serialized).hexdigest()
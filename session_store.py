@@ -0,0 +1,93 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Сессия чата в одном хеше Redis: состояние диалога, user_data и documentId корзины.
+
+    Загрузка и сохранение выполняются одним конвейером (pipeline), а каждое
+    обращение продлевает время жизни ключа, поэтому сессии неактивных
+    чатов удаляются сами и Redis не растет бесконечно.
+    """
+
+    def __init__(self, redis_client, ttl=7 * 24 * 3600, key_prefix='session'):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def _key(self, chat_id):
+        return f"{self.key_prefix}:{chat_id}"
+
+    def load(self, chat_id):
+        """Возвращает сессию чата: словарь с ключами state, user_data и cart_id"""
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pipeline.hgetall(self._key(chat_id))
+        pipeline.expire(self._key(chat_id), self.ttl)
+        raw_session, _ = pipeline.execute()
+
+        try:
+            user_data = json.loads(raw_session.get('user_data') or '{}')
+        except ValueError:
+            logger.warning(f"Повреждены user_data сессии {chat_id}")
+            user_data = {}
+
+        return {
+            'state': raw_session.get('state'),
+            'user_data': user_data,
+            'cart_id': raw_session.get('cart_id'),
+        }
+
+    def save(self, chat_id, state, user_data, cart_id=None):
+        """Сохраняет сессию чата и продлевает ее время жизни"""
+        session = {
+            'state': state,
+            'user_data': json.dumps(user_data, separators=(',', ':')),
+        }
+        if cart_id:
+            session['cart_id'] = cart_id
+
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pipeline.hmset(self._key(chat_id), session)
+        pipeline.expire(self._key(chat_id), self.ttl)
+        pipeline.execute()
+
+    def get_cart_id(self, chat_id):
+        """Возвращает documentId корзины чата или None"""
+        return self.redis_client.hget(self._key(chat_id), 'cart_id')
+
+    def save_cart_id(self, chat_id, cart_id):
+        """Запоминает documentId корзины чата, None - забывает его"""
+        pipeline = self.redis_client.pipeline(transaction=False)
+        if cart_id is None:
+            pipeline.hdel(self._key(chat_id), 'cart_id')
+        else:
+            pipeline.hset(self._key(chat_id), 'cart_id', cart_id)
+        pipeline.expire(self._key(chat_id), self.ttl)
+        pipeline.execute()
+
+    def get_cart_message(self, chat_id):
+        """Возвращает последнее отрисованное сообщение корзины: message_id и отпечаток, или None"""
+        raw_cart_message = self.redis_client.hget(self._key(chat_id), 'cart_message')
+        if not raw_cart_message:
+            return None
+        try:
+            return json.loads(raw_cart_message)
+        except ValueError:
+            logger.warning(f"Поврежден отпечаток корзины сессии {chat_id}")
+            return None
+
+    def save_cart_message(self, chat_id, cart_message):
+        """Запоминает отрисованное сообщение корзины, None - забывает его.
+
+        Пишет отдельное поле хеша, поэтому его можно вызывать из потоков
+        отправки, не затирая state и user_data, сохраняемые обработчиком.
+        """
+        pipeline = self.redis_client.pipeline(transaction=False)
+        if cart_message is None:
+            pipeline.hdel(self._key(chat_id), 'cart_message')
+        else:
+            pipeline.hset(self._key(chat_id), 'cart_message', json.dumps(cart_message, separators=(',', ':')))
+        pipeline.expire(self._key(chat_id), self.ttl)
+        pipeline.execute()
@@ -0,0 +1,215 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import (
+    STRAPI_REQUEST_SECONDS,
+    STRAPI_REQUESTS,
+    STRAPI_REQUESTS_IN_FLIGHT,
+    count_backend_call,
+)
+
+
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+RETRY_STATUSES = (429, 502, 503, 504)
+
+CONNECT_TIMEOUT = 3.05
+
+# Таймаут чтения эндпоинта как доля общего таймаута STRAPI_TIMEOUT:
+# чтение каталога и корзины быстрее, заказы и файлы медленнее.
+ENDPOINT_TIMEOUT_FACTORS = {
+    '/api/products': 0.5,
+    '/api/carts': 0.5,
+    '/api/cart-products': 0.5,
+    '/api/orders': 1.5,
+    '/uploads': 1.5,
+}
+
+
+def create_headers(strapi_token):
+    """Создает заголовки для запросов"""
+    return {
+        "Authorization": f"Bearer {strapi_token}",
+        "Content-Type": "application/json"
+    }
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Запрос не отправлен: размыкатель открыт после серии ошибок Strapi"""
+
+
+class CircuitBreaker:
+    """Размыкатель цепи для запросов к Strapi.
+
+    После failure_threshold ошибок подряд перестает пропускать запросы на
+    recovery_timeout секунд, затем пропускает один пробный запрос: при
+    успехе цепь замыкается, при ошибке снова размыкается.
+    """
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def before_request(self):
+        """Проверяет, можно ли отправить запрос, иначе выбрасывает CircuitOpenError"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.recovery_timeout or self._probe_in_flight:
+                raise CircuitOpenError('Strapi недоступен, запрос отклонен размыкателем')
+            self._probe_in_flight = True
+
+    def record_success(self):
+        """Замыкает цепь после успешного ответа"""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """Учитывает ошибку и размыкает цепь при превышении порога"""
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+def get_endpoint_prefix(url, endpoint_prefixes):
+    """Возвращает самый длинный префикс пути из endpoint_prefixes, с которого начинается URL"""
+    path = urlparse(url).path
+    return max(
+        (prefix for prefix in endpoint_prefixes if path.startswith(prefix)),
+        key=len,
+        default=None
+    )
+
+
+def get_endpoint_setting_name(prefix):
+    """Возвращает суффикс переменной окружения эндпоинта, например CART_PRODUCTS"""
+    return prefix.rsplit('/', 1)[-1].replace('-', '_').upper()
+
+
+def build_endpoint_timeouts(timeout, overrides=None):
+    """Считает таймауты эндпоинтов из общего таймаута чтения.
+
+    overrides - словарь {префикс: таймаут чтения} для эндпоинтов, чей
+    таймаут задан явно; он важнее доли от общего таймаута.
+    """
+    overrides = overrides or {}
+    return {
+        prefix: (CONNECT_TIMEOUT, overrides.get(prefix) or timeout * factor)
+        for prefix, factor in ENDPOINT_TIMEOUT_FACTORS.items()
+    }
+
+
+def get_endpoint_timeout(url, endpoint_timeouts, default_timeout):
+    """Подбирает таймаут по самому длинному совпавшему префиксу пути"""
+    matched_prefix = get_endpoint_prefix(url, endpoint_timeouts)
+    if matched_prefix is None:
+        return default_timeout
+    return endpoint_timeouts[matched_prefix]
+
+
+def get_endpoint_name(url):
+    """Возвращает имя эндпоинта для меток метрик без идентификаторов документов"""
+    return get_endpoint_prefix(url, ENDPOINT_TIMEOUT_FACTORS) or 'other'
+
+
+class StrapiClient:
+    """HTTP-клиент Strapi с пулом keep-alive соединений и повторами запросов"""
+
+    def __init__(self, strapi_url, strapi_token, pool_size=10,
+                 timeout=(3.05, 10), retries=3, backoff_factor=0.3,
+                 endpoint_timeouts=None, circuit_breaker=None):
+        self.strapi_url = strapi_url.rstrip('/')
+        self.timeout = timeout
+        if endpoint_timeouts is None:
+            read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+            endpoint_timeouts = build_endpoint_timeouts(read_timeout)
+        self.endpoint_timeouts = endpoint_timeouts
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry
+        )
+
+        self.session = requests.Session()
+        self.session.headers.update(create_headers(strapi_token))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def build_url(self, path):
+        """Достраивает относительный путь до полного URL Strapi"""
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{self.strapi_url}{path}"
+
+    def request(self, method, path, **kwargs):
+        """Выполняет запрос через общий пул соединений с таймаутом эндпоинта и размыкателем"""
+        url = self.build_url(path)
+        kwargs.setdefault(
+            'timeout', get_endpoint_timeout(url, self.endpoint_timeouts, self.timeout)
+        )
+
+        endpoint = get_endpoint_name(url)
+
+        self.circuit_breaker.before_request()
+        count_backend_call('strapi')
+        try:
+            with STRAPI_REQUESTS_IN_FLIGHT.track(), \
+                    STRAPI_REQUEST_SECONDS.time(method=method, endpoint=endpoint):
+                response = self.session.request(method, url, **kwargs)
+        except Exception:
+            STRAPI_REQUESTS.inc(method=method, endpoint=endpoint, status='error')
+            self.circuit_breaker.record_failure()
+            raise
+
+        STRAPI_REQUESTS.inc(method=method, endpoint=endpoint, status=response.status_code)
+        if response.status_code >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+        response.raise_for_status()
+        return response
+
+    def get(self, path, params=None):
+        """Выполняет GET-запрос и возвращает разобранный JSON"""
+        return self.request('GET', path, params=params).json()
+
+    def post(self, path, payload):
+        """Выполняет POST-запрос и возвращает разобранный JSON"""
+        return self.request('POST', path, json=payload).json()
+
+    def put(self, path, payload):
+        """Выполняет PUT-запрос и возвращает разобранный JSON"""
+        return self.request('PUT', path, json=payload).json()
+
+    def delete(self, path):
+        """Выполняет DELETE-запрос и возвращает объект ответа"""
+        return self.request('DELETE', path)
+
+    def get_bytes(self, url):
+        """Скачивает файл (например, изображение) и возвращает его содержимое"""
+        return self.request('GET', url).content
+
+    def close(self):
+        """Закрывает все соединения пула"""
+        self.session.close()
@@ -0,0 +1,28 @@
+import os
+
+import pytest
+import redis
+
+from benchmarks.fake_strapi import FakeStrapiServer
+
+TEST_REDIS_URL = os.environ.get('TEST_REDIS_URL', 'redis://localhost:6379/15')
+
+
+@pytest.fixture
+def redis_client():
+    """Подключение к Redis из TEST_REDIS_URL, тест пропускается, если Redis недоступен"""
+    client = redis.Redis.from_url(TEST_REDIS_URL, decode_responses=True)
+    try:
+        client.ping()
+    except redis.exceptions.ConnectionError as e:
+        pytest.skip(f"Redis недоступен по {TEST_REDIS_URL}: {e}")
+    return client
+
+
+@pytest.fixture
+def strapi():
+    """Локальная замена Strapi из бенчмарка"""
+    server = FakeStrapiServer(catalog_size=5)
+    server.start()
+    yield server
+    server.shutdown()
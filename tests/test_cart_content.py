@@ -0,0 +1,129 @@
+import json
+import random
+from urllib.parse import urlparse
+
+import pytest
+
+from benchmarks.fake_telegram import FakeBot, make_callback_update, make_context, make_text_update
+from python_bot import create_handlers
+from strapi_client import StrapiClient
+
+
+@pytest.fixture
+def strapi_client(strapi):
+    client = StrapiClient(strapi.url, 'test-token')
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def http_requests(strapi, strapi_client, monkeypatch):
+    """Список (метод, путь) запросов, прошедших через HTTP-адаптер клиента Strapi"""
+    sent = []
+    adapter = strapi_client.session.get_adapter(strapi.url)
+    send = adapter.send
+
+    def counting_send(request, **kwargs):
+        sent.append((request.method, urlparse(request.url).path))
+        return send(request, **kwargs)
+
+    monkeypatch.setattr(adapter, 'send', counting_send)
+    return sent
+
+
+def seed_cart(strapi, chat_id, lines):
+    """Кладет в замену Strapi корзину чата с позициями (documentId позиции, продукт, количество)"""
+    cart_document_id = f"cart{chat_id}"
+    strapi.store.carts[cart_document_id] = {'documentId': cart_document_id, 'tg_id': str(chat_id)}
+    for cart_product_id, product_id, quantity in lines:
+        strapi.store.cart_products[cart_product_id] = {
+            'documentId': cart_product_id,
+            'quantity': quantity,
+            'cart': cart_document_id,
+            'product': product_id,
+        }
+
+
+def open_menu(strapi_client, redis_client, chat_id):
+    handler = create_handlers(strapi_client, redis_client)
+    bot = FakeBot()
+    context = make_context(bot)
+    handler(make_text_update(bot, chat_id, '/start'), context)
+    return handler, bot, context
+
+
+def view_cart(handler, bot, context, chat_id):
+    handler(make_callback_update(bot, chat_id, 'view_cart'), context)
+
+
+LINES = [
+    ('line1', 'product00001', 2),
+    ('line2', 'product00002', 1),
+    ('line3', 'product00003', 3),
+]
+TOTAL_SUM = 2 * 101 + 102 + 3 * 103
+
+
+def test_first_cart_view_finds_cart_and_loads_it_with_one_request(strapi, strapi_client, http_requests, redis_client):
+    chat_id = random.randint(10 ** 9, 2 * 10 ** 9)
+    seed_cart(strapi, chat_id, LINES)
+    handler, bot, context = open_menu(strapi_client, redis_client, chat_id)
+
+    http_requests.clear()
+    view_cart(handler, bot, context, chat_id)
+
+    assert http_requests == [
+        ('GET', '/api/carts'),
+        ('GET', f'/api/carts/cart{chat_id}'),
+    ]
+    assert bot.find_callback_data(chat_id, 'remove_') == 'remove_line1'
+
+
+def test_show_cart_is_served_from_projection_on_second_view(strapi, strapi_client, http_requests, redis_client):
+    chat_id = random.randint(10 ** 9, 2 * 10 ** 9)
+    seed_cart(strapi, chat_id, LINES)
+    handler, bot, context = open_menu(strapi_client, redis_client, chat_id)
+    view_cart(handler, bot, context, chat_id)
+    handler(make_callback_update(bot, chat_id, 'back_to_menu'), context)
+
+    http_requests.clear()
+    view_cart(handler, bot, context, chat_id)
+
+    assert http_requests == []
+    cart = redis_client.hgetall(f"cart:{chat_id}:items")
+    assert sorted(cart) == ['line1', 'line2', 'line3']
+
+
+def test_cart_lines_without_product_cost_one_request_each(strapi, strapi_client, http_requests,
+                                                          redis_client, monkeypatch):
+    chat_id = random.randint(10 ** 9, 2 * 10 ** 9)
+    seed_cart(strapi, chat_id, LINES)
+    lines_without_product = {'line2', 'line3'}
+    cart_view = strapi._cart_view
+
+    def cart_view_without_products(cart):
+        view = cart_view(cart)
+        for cart_product in view['cart_products']:
+            if cart_product['documentId'] in lines_without_product:
+                cart_product['product'] = None
+        return view
+
+    monkeypatch.setattr(strapi, '_cart_view', cart_view_without_products)
+    handler, bot, context = open_menu(strapi_client, redis_client, chat_id)
+
+    http_requests.clear()
+    view_cart(handler, bot, context, chat_id)
+
+    assert http_requests[:2] == [
+        ('GET', '/api/carts'),
+        ('GET', f'/api/carts/cart{chat_id}'),
+    ]
+    assert sorted(http_requests[2:]) == [
+        ('GET', '/api/cart-products/line2'),
+        ('GET', '/api/cart-products/line3'),
+    ]
+    cart_sum = sum(
+        float(line['price']) * line['quantity']
+        for line in map(json.loads, redis_client.hgetall(f"cart:{chat_id}:items").values())
+    )
+    assert cart_sum == TOTAL_SUM
@@ -0,0 +1,17 @@
+import pytest
+
+from python_bot import parse_quantity
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('2', 2.0),
+    (' 1.5 ', 1.5),
+    ('0,5', 0.5),
+])
+def test_valid_quantity_is_parsed(text, expected):
+    assert parse_quantity(text) == expected
+
+
+@pytest.mark.parametrize('text', ['', 'abc', '0', '-1', 'nan', 'inf', '-inf', '1e400'])
+def test_invalid_quantity_is_rejected(text):
+    assert parse_quantity(text) is None
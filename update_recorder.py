@@ -0,0 +1,82 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+EMAIL_PATTERN = re.compile(r'[^\s@]+@[^\s@]+')
+LONG_NUMBER_PATTERN = re.compile(r'\d{5,}')
+
+
+def anonymize_text(text):
+    """Заменяет в тексте email и длинные числа (телефоны, номера карт) заглушками"""
+    text = EMAIL_PATTERN.sub('user@example.com', text)
+    return LONG_NUMBER_PATTERN.sub(lambda match: '0' * len(match.group()), text)
+
+
+class UpdateRecorder:
+    """Пишет входящие обновления в компактный JSONL-лог для последующего воспроизведения.
+
+    Каждая строка содержит время получения, обезличенный идентификатор
+    чата (HMAC от chat_id с солью процесса), тип обновления и его данные.
+    Из текста сообщений удаляются email и длинные числа, callback_data
+    пишется как есть: в ней только идентификаторы документов Strapi.
+    """
+
+    def __init__(self, path, salt=None):
+        self.salt = (salt or os.urandom(16).hex()).encode('utf-8')
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def record(self, update):
+        """Записывает обновление в лог, ошибки записи только логируются"""
+        if update.inline_query:
+            kind, chat_id, data = 'inline', update.inline_query.from_user.id, update.inline_query.query
+        elif update.callback_query:
+            query = update.callback_query
+            # У callback от inline-сообщения нет message, чат определяется по пользователю
+            chat_id = query.message.chat_id if query.message is not None else query.from_user.id
+            kind, data = 'callback', query.data
+        elif update.message and update.message.text is not None:
+            kind, chat_id, data = 'text', update.message.chat_id, update.message.text
+        else:
+            return
+
+        if kind != 'callback':
+            data = anonymize_text(data)
+
+        entry = {'ts': round(time.time(), 3), 'chat': self._anonymize_chat(chat_id), 'kind': kind, 'data': data}
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+        try:
+            with self._lock:
+                self._file.write(line + '\n')
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось записать обновление в лог: {e}")
+
+    def handle_update(self, update, context):
+        """Обработчик для диспетчера: записывает обновление при приеме"""
+        self.record(update)
+
+    def close(self):
+        """Закрывает файл лога"""
+        with self._lock:
+            self._file.close()
+
+    def _anonymize_chat(self, chat_id):
+        return hmac.new(self.salt, str(chat_id).encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+
+def read_recorded_updates(path):
+    """Читает лог UpdateRecorder и возвращает записи, упорядоченные по времени"""
+    entries = []
+    with open(path, encoding='utf-8') as log_file:
+        for line in log_file:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    return sorted(entries, key=lambda entry: entry['ts'])
@@ -0,0 +1,202 @@
+import json
+import logging
+import socket
+import threading
+from abc import ABC, abstractmethod
+
+from redis.exceptions import ResponseError
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from dispatching import ChatOrderedExecutor, get_update_chat_id
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for_chat(chat_id, shards):
+    """Возвращает номер шарда, за которым закреплен чат"""
+    return int(chat_id or 0) % shards
+
+
+def get_stream_name(stream_prefix, shard):
+    """Возвращает имя Redis stream шарда"""
+    return f"{stream_prefix}:{shard}"
+
+
+class UpdateStreamPublisher:
+    """Публикует обновления Telegram в Redis streams, разбитые на шарды по chat_id"""
+
+    def __init__(self, redis_client, shards, stream_prefix='updates', maxlen=100000):
+        self.redis_client = redis_client
+        self.shards = shards
+        self.stream_prefix = stream_prefix
+        self.maxlen = maxlen
+
+    def publish(self, update):
+        """Кладет обновление в stream шарда его чата"""
+        shard = shard_for_chat(get_update_chat_id(update), self.shards)
+        self.redis_client.xadd(
+            get_stream_name(self.stream_prefix, shard),
+            {'update': json.dumps(update.to_dict())},
+            maxlen=self.maxlen
+        )
+
+    def handle_update(self, update, context):
+        """Обработчик для диспетчера ingest-процесса"""
+        self.publish(update)
+
+
+class StreamConsumer(ABC):
+    """Читает Redis stream через consumer group и передает сообщения в _dispatch.
+
+    Наследник подтверждает сообщение через _finish_message после
+    обработки; если процесс упал, неподтвержденные сообщения при его
+    перезапуске читаются заново, а зависшие дольше claim_idle_ms
+    забираются через XCLAIM - у других потребителей группы и у самого
+    потребителя, если сообщение осталось неподтвержденным после ошибки.
+
+    Наследник реализует _dispatch и close(): close() освобождает пул
+    потоков обработки и вызывается в конце run(), а также владельцем
+    воркера, если run() прерван.
+    """
+
+    def __init__(self, redis_client, stream, group, consumer_name, batch_size=50, block_ms=5000,
+                 claim_idle_ms=60000):
+        self.redis_client = redis_client
+        self.stream = stream
+        self.group = group
+        self.consumer_name = consumer_name
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self._stopped = threading.Event()
+        self._in_progress = set()
+        self._in_progress_lock = threading.Lock()
+
+    def run(self):
+        """Обрабатывает stream до вызова stop()"""
+        self._ensure_group()
+        self._read_messages('0')
+
+        while not self._stopped.is_set():
+            self._claim_stale_messages()
+            self._read_messages('>', block=self.block_ms)
+
+        self.close()
+
+    def stop(self):
+        """Просит потребителя завершиться после текущей пачки сообщений"""
+        self._stopped.set()
+
+    def _ensure_group(self):
+        try:
+            self.redis_client.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def _read_messages(self, last_id, block=None):
+        while True:
+            response = self.redis_client.xreadgroup(
+                self.group, self.consumer_name, {self.stream: last_id},
+                count=self.batch_size, block=block
+            )
+            messages = response[0][1] if response else []
+            for message_id, fields in messages:
+                self._deliver(message_id, fields)
+
+            if last_id == '>' or not messages:
+                return
+            last_id = messages[-1][0]
+
+    def _claim_stale_messages(self):
+        pending_messages = self.redis_client.xpending_range(
+            self.stream, self.group, '-', '+', self.batch_size
+        )
+        with self._in_progress_lock:
+            stale_ids = [
+                pending_message['message_id'] for pending_message in pending_messages
+                if pending_message['message_id'] not in self._in_progress
+                and pending_message['time_since_delivered'] >= self.claim_idle_ms
+            ]
+        if not stale_ids:
+            return
+
+        claimed_messages = self.redis_client.xclaim(
+            self.stream, self.group, self.consumer_name, self.claim_idle_ms, stale_ids
+        )
+        for message_id, fields in claimed_messages:
+            self._deliver(message_id, fields)
+
+    def _deliver(self, message_id, fields):
+        with self._in_progress_lock:
+            if message_id in self._in_progress:
+                return
+            self._in_progress.add(message_id)
+        self._dispatch(message_id, fields)
+
+    def _finish_message(self, message_id, ack=True):
+        """Подтверждает сообщение или оставляет его в pending для повторной доставки через XCLAIM"""
+        if ack:
+            self.redis_client.xack(self.stream, self.group, message_id)
+        with self._in_progress_lock:
+            self._in_progress.discard(message_id)
+
+    @abstractmethod
+    def close(self):
+        """Дожидается обработки принятых сообщений и освобождает ресурсы потребителя"""
+
+    @abstractmethod
+    def _dispatch(self, message_id, fields):
+        """Передает прочитанное сообщение в обработку"""
+
+
+class UpdateStreamWorker(StreamConsumer):
+    """Воркер одного шарда: читает обновления из consumer group и выполняет конечный автомат бота.
+
+    Каждый шард обслуживается одним воркером, поэтому состояние чата
+    меняет только один процесс. Сообщение подтверждается (XACK) после
+    обработки обновления.
+    """
+
+    def __init__(self, redis_client, dispatcher, handler, shard, stream_prefix='updates',
+                 group='bot-workers', consumer_name=None, batch_size=50, block_ms=5000,
+                 claim_idle_ms=60000, max_workers=16):
+        super().__init__(
+            redis_client,
+            get_stream_name(stream_prefix, shard),
+            group,
+            consumer_name or f"{socket.gethostname()}-{shard}",
+            batch_size=batch_size,
+            block_ms=block_ms,
+            claim_idle_ms=claim_idle_ms
+        )
+        self.dispatcher = dispatcher
+        self.handler = handler
+        self.executor = ChatOrderedExecutor(max_workers=max_workers)
+        self._in_flight = threading.BoundedSemaphore(batch_size * 2)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def _dispatch(self, message_id, fields):
+        if not fields:
+            self._finish_message(message_id)
+            return
+
+        update = Update.de_json(json.loads(fields['update']), self.dispatcher.bot)
+        context = CallbackContext.from_update(update, self.dispatcher)
+
+        self._in_flight.acquire()
+        self.executor.submit(
+            get_update_chat_id(update), self._process, message_id, update, context
+        )
+
+    def _process(self, message_id, update, context):
+        try:
+            self.handler(update, context)
+        except Exception:
+            logger.exception(f"Ошибка обработки сообщения {message_id}")
+        finally:
+            self._finish_message(message_id)
+            self._in_flight.release()